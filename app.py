@@ -2,8 +2,14 @@ from flask import Flask, render_template, request, jsonify, send_from_directory,
 import requests
 from database import init_db, add_download, update_download_status, get_downloads
 import os
+import gzip
 import sqlite3
 
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
 app = Flask(__name__)
 
 BACKEND_URL = "http://localhost:8001"  # FastAPI backend URL
@@ -11,36 +17,133 @@ BACKEND_URL = "http://localhost:8001"  # FastAPI backend URL
 # Default download directory (fixed to match Docker volume mount)
 DEFAULT_DOWNLOAD_DIR = "/app/downloads"
 
+# Number of search results requested from the backend per page
+SEARCH_PAGE_SIZE = 30
+
+# JSON responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+
+@app.after_request
+def cache_and_compress(response):
+    """Add ETags, answer conditional requests and compress JSON responses"""
+    if response.mimetype != 'application/json' or response.direct_passthrough:
+        return response
+    
+    if response.status_code == 200:
+        if 'ETag' not in response.headers:
+            # Weak, the same ETag is sent whichever encoding the body is compressed with below
+            response.add_etag(weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response = response.make_conditional(request)
+    
+    response.vary.add('Accept-Encoding')
+    if response.status_code != 200 or response.content_length is None or response.content_length < COMPRESSION_MIN_SIZE:
+        return response
+    
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(response.get_data(), quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def backend_get(url, **kwargs):
+    """GET from the backend, passing the browser's If-None-Match along"""
+    headers = {}
+    if request.headers.get('If-None-Match'):
+        headers['If-None-Match'] = request.headers['If-None-Match']
+    return requests.get(url, headers=headers, **kwargs)
+
+def not_modified(response):
+    """Relay a backend 304 to the browser"""
+    return '', 304, {'ETag': response.headers.get('ETag', '')}
+
+def with_backend_etag(flask_response, response):
+    """Reuse the backend ETag, it already identifies the schedule version and query"""
+    if response.headers.get('ETag'):
+        flask_response.headers['ETag'] = response.headers['ETag']
+    return flask_response
+
 @app.route('/')
 def index():
     # Get recent downloads for display
     downloads = get_downloads(limit=10)
     return render_template('index.html', downloads=downloads)
 
+def search_params():
+    """Forward paging, grouping and facet filter arguments to the backend"""
+    params = [(name, value) for name, value in request.args.items(multi=True) if name != 'q']
+    if 'limit' not in request.args:
+        params.append(('limit', SEARCH_PAGE_SIZE))
+    return params
+
+def proxy_search_page(url):
+    try:
+        response = backend_get(url, params=search_params())
+        if response.status_code == 304:
+            return not_modified(response)
+        data = response.json()
+        
+        if not response.ok:
+            return jsonify({'error': data.get('detail', 'Search failed')}), response.status_code
+        
+        # Log the page size for debugging
+        print(f"Backend returned {len(data.get('results', []))} of {data.get('total', 0)} results")
+            
+        return with_backend_etag(jsonify({
+            'results': data.get('results', []),
+            'total': data.get('total', 0),
+            'next_cursor': data.get('next_cursor'),
+            'facets': data.get('facets', {})
+        }), response)
+    except requests.RequestException as e:
+        print("Search error:", str(e))
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/search')
 def search():
     query = request.args.get('q', '')
+    return proxy_search_page(f"{BACKEND_URL}/api/search/{query}")
+
+@app.route('/browse')
+def browse():
+    return proxy_search_page(f"{BACKEND_URL}/api/browse")
+
+@app.route('/suggest')
+def suggest():
     try:
-        response = requests.get(f"{BACKEND_URL}/api/search/{query}")
+        response = backend_get(f"{BACKEND_URL}/api/suggest", params=request.args, timeout=5)
+        if response.status_code == 304:
+            return not_modified(response)
         data = response.json()
         
-        # Log the response for debugging
-        print("Backend response:", data)
+        if not response.ok:
+            return jsonify({'error': data.get('detail', 'Suggestions failed')}), response.status_code
+        
+        return with_backend_etag(jsonify(data), response)
+    except requests.RequestException as e:
+        print("Suggestion error:", str(e))
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/series/<sid>/episodes')
+def series_episodes(sid):
+    params = {'limit': request.args.get('limit', SEARCH_PAGE_SIZE)}
+    if request.args.get('cursor'):
+        params['cursor'] = request.args['cursor']
+    try:
+        response = backend_get(f"{BACKEND_URL}/api/series/{sid}/episodes", params=params)
+        if response.status_code == 304:
+            return not_modified(response)
+        data = response.json()
         
         if not response.ok:
-            return jsonify({'error': data.get('detail', 'Search failed')}), response.status_code
-            
-        # Ensure we return a list
-        if isinstance(data, list):
-            results = data
-        elif isinstance(data, dict):
-            results = data.get('results', []) or data.get('items', [])
-        else:
-            results = []
-            
-        return jsonify(results)
+            return jsonify({'error': data.get('detail', 'Episode listing failed')}), response.status_code
+        
+        return with_backend_etag(jsonify(data), response)
     except requests.RequestException as e:
-        print("Search error:", str(e))
+        print("Episode listing error:", str(e))
         return jsonify({'error': str(e)}), 500
 
 @app.route('/download', methods=['POST'])
@@ -122,6 +225,36 @@ def check_status(pid):
         print("Status check error:", str(e))
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/epg-status')
+def epg_status():
+    try:
+        response = backend_get(f"{BACKEND_URL}/api/epg-status", timeout=10)
+        if response.status_code == 304:
+            return not_modified(response)
+        return with_backend_etag(jsonify(response.json()), response), response.status_code
+    except requests.RequestException as e:
+        print("EPG status error:", str(e))
+        return jsonify({'epg_available': False, 'error': str(e)}), 500
+
+@app.route('/api/download-epg', methods=['POST'])
+def download_epg():
+    try:
+        # The backend only starts the refresh job, its progress is polled below
+        response = requests.post(f"{BACKEND_URL}/api/download-epg", timeout=10)
+        return jsonify(response.json()), response.status_code
+    except requests.RequestException as e:
+        print("EPG download error:", str(e))
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/api/download-epg/<job_id>')
+def epg_job_status(job_id):
+    try:
+        response = requests.get(f"{BACKEND_URL}/api/download-epg/{job_id}", timeout=10)
+        return jsonify(response.json()), response.status_code
+    except requests.RequestException as e:
+        print("EPG job status error:", str(e))
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 @app.route('/downloads')
 def get_download_history():
     downloads = get_downloads()
@@ -0,0 +1,80 @@
+"""
+Conditional request and compression helpers for the JSON API responses.
+"""
+import gzip
+import hashlib
+from typing import Optional
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def content_etag(body: bytes) -> str:
+    """Build an ETag from the response body itself
+    
+    It is weak because the same ETag is sent for the identity, gzip and br
+    encodings of the body, a strong ETag would have to differ between them.
+    """
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag using weak comparison"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    wanted = etag.removeprefix('W/')
+    return any(candidate.strip().removeprefix('W/') == wanted for candidate in if_none_match.split(','))
+
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """Return a 304 response if the client already holds this ETag"""
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept-Encoding'})
+    return None
+
+
+def _accepted_encodings(request: Request) -> set:
+    encodings = set()
+    for part in request.headers.get('accept-encoding', '').split(','):
+        name, _, params = part.partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def json_response(request: Request, body: bytes, etag: Optional[str] = None) -> Response:
+    """Send a serialized JSON body with an ETag, answering 304 or compressing when possible"""
+    etag = etag or content_etag(body)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+
+    headers = {'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if len(body) >= COMPRESSION_MIN_SIZE:
+        encodings = _accepted_encodings(request)
+        if brotli is not None and 'br' in encodings:
+            body = brotli.compress(body, quality=BROTLI_QUALITY)
+            headers['Content-Encoding'] = 'br'
+        elif 'gzip' in encodings:
+            body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
+
+    return Response(content=body, media_type='application/json', headers=headers)
@@ -1,19 +1,31 @@
 import os
 import sys
 import json
+import time
+import uuid
+import hashlib
+import itertools
 import logging
 import asyncio
 import subprocess
 from pathlib import Path
-from typing import Optional, Dict, List
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from typing import Optional, Dict, List, Tuple
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, field_validator
 
+from .http_cache import json_response, not_modified
+from .schedule import compact_schedule
+from .schedule_source import ScheduleSource
+from . import script_output
+from .search import QueryCache, SearchIndex, encode_json, ids_from_bitmap, normalize_query
+
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
+# Receives what ruvsarpur.py prints while the backend refreshes the schedule
+script_logger = logging.getLogger('ruvsarpur')
 
 # EPG refresh interval (2 hours in seconds)
 EPG_REFRESH_INTERVAL = 2 * 60 * 60  # 2 hours = 7200 seconds
@@ -26,85 +38,440 @@ RUVSARPUR_SCRIPT = os.environ.get('RUVSARPUR_SCRIPT', os.path.join(RUVSARPUR_PAT
 SCHEDULE_FILE = os.environ.get('SCHEDULE_FILE', "/home/appuser/.ruvsarpur/tvschedule.json")
 SCHEDULE_FILE_FALLBACK = os.environ.get('SCHEDULE_FILE_FALLBACK', "/app/data/.ruvsarpur/tvschedule.json")
 
+# Optional SQLite schedule store shared with ruvsarpur.py, set SCHEDULE_STORE=sqlite to enable it
+SCHEDULE_STORE = os.environ.get('SCHEDULE_STORE', 'json')
+SCHEDULE_DB_FILE = os.environ.get('SCHEDULE_DB_FILE', os.path.join(os.path.dirname(SCHEDULE_FILE), "tvschedule.db"))
+
+# IMDB lookups cached by EPG refreshes, shared with ruvsarpur.py
+IMDB_CACHE_FILE = os.environ.get('IMDB_CACHE_FILE', os.path.join(os.path.dirname(SCHEDULE_FILE), "imdb-cache.json"))
+
+# Number of api.ruv.is requests an EPG refresh makes at once
+EPG_FETCH_CONCURRENCY = int(os.environ.get('EPG_FETCH_CONCURRENCY', 10))
+
+# Cached api.ruv.is responses revalidated by EPG refreshes, EPG_HTTP_CACHE_MB=0 disables the cache
+EPG_HTTP_CACHE_DIR = os.environ.get('EPG_HTTP_CACHE_DIR', os.path.join(os.path.dirname(SCHEDULE_FILE), "httpcache"))
+EPG_HTTP_CACHE_MB = int(os.environ.get('EPG_HTTP_CACHE_MB', 256))
+
 # Default download directory
 DEFAULT_DOWNLOAD_DIR = "/app/downloads"
 
+# Page size limits for search results
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 200
+
+# Number of title suggestions returned by /api/suggest
+SUGGEST_DEFAULT_LIMIT = 8
+SUGGEST_MAX_LIMIT = 50
+
+# Number of distinct queries kept in the search result cache
+SEARCH_CACHE_SIZE = int(os.environ.get('SEARCH_CACHE_SIZE', 256))
+
+# Seconds between checks of the schedule file when no change notification arrives
+SCHEDULE_POLL_INTERVAL = float(os.environ.get('SCHEDULE_POLL_INTERVAL', 5))
+
+# Owner given to the schedule files EPG refreshes write, the host user of the mounted data directories
+HOST_UID = int(os.environ.get('HOST_UID', -1))
+HOST_GID = int(os.environ.get('HOST_GID', -1))
+
+# Number of finished EPG refresh jobs kept for /api/download-epg/{job_id}
+EPG_JOBS_KEPT = 20
+
+# Longest time in seconds a refresh without a schedule to serve goes without publishing the series downloaded since
+EPG_PUBLISH_INTERVAL = float(os.environ.get('EPG_PUBLISH_INTERVAL', 30))
+
 # Verify the script exists
 if not os.path.exists(RUVSARPUR_SCRIPT):
     raise FileNotFoundError(f"Could not find ruvsarpur.py script at: {RUVSARPUR_SCRIPT}")
 
+# ruvsarpur.py and its schedule modules are used as libraries
+if RUVSARPUR_PATH not in sys.path:
+    sys.path.append(RUVSARPUR_PATH)
+import ruvsarpur
+import fetchengine
+import schedulefile
+import schedulestore
+
 # Create downloads directory if it doesn't exist
 os.makedirs(DEFAULT_DOWNLOAD_DIR, exist_ok=True)
 
-# Global variable to hold the schedule data in memory
-schedule_data: Dict = {}
-
-def load_schedule():
-    """Load the TV schedule from JSON file into memory"""
-    global schedule_data
-    
-    # Try multiple locations for the schedule file
-    possible_locations = [
-        SCHEDULE_FILE,                                          # /home/appuser/.ruvsarpur/tvschedule.json
-        SCHEDULE_FILE_FALLBACK,                                # /app/data/.ruvsarpur/tvschedule.json
-        "/root/.ruvsarpur/tvschedule.json",                    # Fallback location
-        "/app/.ruvsarpur/tvschedule.json"                     # Legacy location
-    ]
-    
-    schedule_file = None
-    for location in possible_locations:
-        if os.path.exists(location):
-            schedule_file = location
-            break
-    
-    if not schedule_file:
-        logger.error(f"No schedule file found in any of these locations: {possible_locations}")
-        schedule_data = {}
-        return
+class ScheduleSnapshot:
+    """A loaded schedule together with its search index
     
-    try:
+    Snapshots are never modified once built. A reload builds a new one and
+    swaps the global reference, requests keep using the snapshot they started with.
+    A partial snapshot holds the series a refresh has downloaded so far.
+    """
+    def __init__(self, data: Dict, version: int, source: Optional[str] = None, journal_offset: int = 0, partial: bool = False):
+        self.data = data
+        self.index = SearchIndex(data)
+        self.version = version
+        self.source = source
+        # How far the schedule file's change journal has been applied to data
+        self.journal_offset = journal_offset
+        self.partial = partial
+
+# Versions of the snapshots, every snapshot gets the next one when it is built so no two share a version
+snapshot_versions = itertools.count(1)
+
+# The schedule currently served, replaced as a whole on every reload
+snapshot = ScheduleSnapshot({}, 0)
+
+# Distinguishes ETags handed out before and after a backend restart
+SCHEDULE_ETAG_PREFIX = uuid.uuid4().hex[:8]
+search_cache = QueryCache(SEARCH_CACHE_SIZE)
+
+# Progress of the background schedule reload, reported by /api/reload-status
+reload_state: Dict = {
+    "state": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "duration": None,
+    "source": None,
+    "items": 0,
+    "error": None
+}
+reload_task: Optional[asyncio.Task] = None
+reload_pending = False
+
+# EPG refresh jobs by job id, each with the progress counters of its refresh
+epg_jobs: Dict[str, Dict] = {}
+# The running EPG refresh job, triggers while it runs attach to it instead of starting another one
+epg_job: Optional[Dict] = None
+# Held while an EPG refresh runs, the schedule file's lock also keeps out refreshes by ruvsarpur.py processes
+epg_refresh_lock = asyncio.Lock()
+
+# The schedule file location, resolved once, with its cached stat result
+schedule_source = ScheduleSource([
+    SCHEDULE_FILE,                                          # /home/appuser/.ruvsarpur/tvschedule.json
+    SCHEDULE_FILE_FALLBACK,                                # /app/data/.ruvsarpur/tvschedule.json
+    "/root/.ruvsarpur/tvschedule.json",                    # Fallback location
+    "/app/.ruvsarpur/tvschedule.json"                     # Legacy location
+], SCHEDULE_DB_FILE, schedulefile.JOURNAL_SUFFIX)
+
+def apply_journal_records(previous: ScheduleSnapshot) -> Optional[ScheduleSnapshot]:
+    """Build a snapshot from the previous one and the journal records appended since it was loaded
+    
+    Returns None if the journal does not continue where the previous snapshot left off.
+    """
+    records, offset = schedulefile.read_journal(previous.source, previous.journal_offset)
+    if records is None:
+        return None
+    logger.info(f"Applying {len(records)} schedule journal records")
+    
+    data = dict(previous.data)
+    schedulefile.apply_journal(data, [
+        {**record, 'items': compact_schedule(record['items'])} if record['op'] == 'upsert' else record
+        for record in records
+    ])
+    return ScheduleSnapshot(data, next(snapshot_versions), previous.source, offset)
+
+def load_schedule(previous: ScheduleSnapshot) -> ScheduleSnapshot:
+    """Read the TV schedule and build its search index
+    
+    This blocks for the whole parse and index build, it runs in a worker thread.
+    When only the schedule file's journal changed since the previous snapshot
+    the new journal records are applied to it instead of reading the whole file.
+    """
+    # Remember which file versions this load reads so the watcher only reacts to later changes
+    previous_files = schedule_source.loaded
+    schedule_source.loaded = schedule_source.refresh()
+    schedule_file = schedule_source.path
+    
+    if previous.data and previous.source == schedule_file and previous_files[:3] == schedule_source.loaded[:3]:
+        loaded = apply_journal_records(previous)
+        if loaded is not None:
+            return loaded
+    
+    # The schedule database is used whenever it is at least as new as the json export and its journal
+    use_store = schedule_source.db_stat is not None and all(
+        stat is None or schedule_source.db_stat.st_mtime >= stat.st_mtime
+        for stat in (schedule_source.stat, schedule_source.journal_stat)
+    )
+    
+    if not schedule_file and not use_store:
+        raise FileNotFoundError("No schedule file found")
+    
+    if use_store:
+        logger.info(f"Loading schedule from {SCHEDULE_DB_FILE}")
+        with schedulestore.ScheduleStore(SCHEDULE_DB_FILE) as store:
+            data = store.read_schedule() or {}
+    else:
         logger.info(f"Loading schedule from {schedule_file}")
-        with open(schedule_file, 'r', encoding='utf-8') as f:
-            schedule_data = json.load(f)
-        logger.info(f"Loaded {len(schedule_data)} items from schedule")
-    except Exception as e:
-        logger.error(f"Error loading schedule from {schedule_file}: {str(e)}")
-        schedule_data = {}
+        # Loads the binary snapshot next to the json file when it is still fresh, in either schedule format
+        data, journal_offset = schedulefile.load_schedule(schedule_file)
+        if SCHEDULE_STORE == 'sqlite':
+            # Only reached while the store is behind the json file, e.g. it was written without the store or
+            # the store write failed, the writers update the store after the json file so it is not rewritten on every reload
+            logger.info(f"Writing schedule to {SCHEDULE_DB_FILE}")
+            with schedulestore.ScheduleStore(SCHEDULE_DB_FILE) as store:
+                store.write_schedule(data)
+            # Writing the store is not a change that needs another reload
+            schedule_source.loaded = schedule_source.refresh()
+    logger.info(f"Loaded {len(data)} items from schedule")
+    
+    # Only the compact form is kept, the parsed file is released with this frame
+    data = compact_schedule(data)
+    loaded = ScheduleSnapshot(data, next(snapshot_versions), SCHEDULE_DB_FILE if use_store else schedule_file, 0 if use_store else journal_offset)
+    logger.info(f"Built search index over {len(loaded.index)} items")
+    return loaded
+
+def refresh_epg(progress: Optional[fetchengine.RefreshProgress] = None, on_series=None) -> ScheduleSnapshot:
+    """Refresh the TV schedule with ruvsarpur.py and build a snapshot from it
+    
+    The refresh is incremental, only the series whose listing changed are
+    downloaded, and ruvsarpur.py falls back to a full refresh when the
+    schedule is too old. The schedule is saved to the schedule file as the
+    command line would do it, the snapshot is built from the refreshed
+    dictionary instead of reading the file back. This blocks for the whole
+    download, it runs in a worker thread.
+    """
+    # The file being served is the one refreshed, the preferred location only when there is none yet
+    schedule_file = schedule_source.path or SCHEDULE_FILE
+    db_file = SCHEDULE_DB_FILE if SCHEDULE_STORE == 'sqlite' or os.path.isfile(SCHEDULE_DB_FILE) else None
+    # The progress bars and summaries ruvsarpur.py prints for the command line go to the log
+    with script_output.install(script_logger, 'fetch').capture():
+        # The existing schedule is read once the refresh lock is held, a ruvsarpur.py refresh cannot be writing it then
+        schedule = ruvsarpur.refreshTvSchedule(
+            None, schedule_file, db_file, IMDB_CACHE_FILE,
+            load_existing=True,
+            incremental=True,
+            fetch_concurrency=EPG_FETCH_CONCURRENCY,
+            http_cache_dir=EPG_HTTP_CACHE_DIR,
+            http_cache_size=EPG_HTTP_CACHE_MB * 1024 * 1024,
+            progress=progress,
+            on_series=on_series
+        )
+    if len(schedule) <= 1:
+        raise RuntimeError("No schedule items were downloaded")
+    
+    # As entrypoint.sh did after the refresh it used to run before startup
+    export_schedule_files(schedule_file)
+    
+    # The files were just written from this schedule, the watcher must not load them again
+    schedule_source.loaded = schedule_source.refresh()
+    # An incremental refresh journals its changes, later journal records continue after them
+    journal_offset = schedule_source.journal_stat.st_size if schedule_source.journal_stat is not None else 0
+    loaded = ScheduleSnapshot(compact_schedule(schedule), next(snapshot_versions), schedule_source.path, journal_offset)
+    logger.info(f"Built search index over {len(loaded.index)} refreshed items")
+    return loaded
+
+def export_schedule_files(schedule_file: str):
+    """Copy a refreshed schedule to the fallback location and give both copies to the host user
+    
+    The sidecar and journal go along with the schedule file, an incremental
+    refresh only wrote its changes to the journal. Every copy is replaced
+    atomically, readers of the fallback location never see a partial file.
+    """
+    files = [schedule_file]
+    if os.path.abspath(schedule_file) != os.path.abspath(SCHEDULE_FILE_FALLBACK) and os.path.isdir(os.path.dirname(SCHEDULE_FILE_FALLBACK)):
+        files.append(SCHEDULE_FILE_FALLBACK)
+        try:
+            schedulefile.copy_schedule(schedule_file, SCHEDULE_FILE_FALLBACK)
+        except OSError as e:
+            logger.warning(f"Could not copy the schedule to {SCHEDULE_FILE_FALLBACK}: {str(e)}")
+    
+    if HOST_UID == -1 and HOST_GID == -1:
+        return
+    for path in files:
+        for suffix in ('', schedulefile.META_SUFFIX, schedulefile.JOURNAL_SUFFIX):
+            try:
+                os.chown(path + suffix, HOST_UID, HOST_GID)
+            except OSError:
+                # Missing, or the backend does not run as root
+                pass
+
+def install_snapshot(loaded: ScheduleSnapshot):
+    """Start serving a new snapshot"""
+    global snapshot
+    
+    snapshot = loaded
+    search_cache.clear()
+    reload_state.update(state="ready", source=loaded.source, items=len(loaded.index), error=None)
+
+def install_partial_snapshot(partial: ScheduleSnapshot):
+    """Start serving the series a refresh has downloaded so far, unless a complete schedule is served already"""
+    if snapshot.data and not snapshot.partial:
+        return
+    install_snapshot(partial)
+
+class SeriesPublisher:
+    """Serves the series of a refresh as they are downloaded, for a backend without a schedule
+    
+    Called on the refresh's worker thread with every downloaded series. The
+    search index over the series so far is rebuilt there whenever their number
+    has doubled or EPG_PUBLISH_INTERVAL seconds have passed, which keeps the
+    rebuilds to a few times the cost of the final one, and the snapshot is
+    swapped in on the event loop.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.items: Dict = {}
+        self.published_items = 0
+        self.published_at = 0.0
+    
+    def __call__(self, sid: str, series_schedule: Dict):
+        try:
+            self.items.update(compact_schedule(series_schedule))
+            now = time.monotonic()
+            if len(self.items) < 2 * self.published_items and now - self.published_at < EPG_PUBLISH_INTERVAL:
+                return
+            self.published_items = len(self.items)
+            self.published_at = now
+            partial = ScheduleSnapshot(dict(self.items), next(snapshot_versions), partial=True)
+            self.loop.call_soon_threadsafe(install_partial_snapshot, partial)
+            logger.info(f"Publishing {len(partial.index)} items of the schedule being refreshed")
+        except Exception as e:
+            # The refresh itself goes on, the series are served once it is done
+            logger.error(f"Error publishing refreshed series {sid}: {str(e)}")
+
+async def run_reloads():
+    """Reload the schedule until no further reload has been requested"""
+    global reload_pending
+    
+    while reload_pending:
+        reload_pending = False
+        started = time.time()
+        reload_state.update(state="loading", started_at=started, error=None)
+        try:
+            loaded = await asyncio.to_thread(load_schedule, snapshot)
+        except Exception as e:
+            # Keep serving the previous snapshot
+            logger.error(f"Error loading schedule: {str(e)}")
+            reload_state.update(state="failed", error=str(e))
+        else:
+            install_snapshot(loaded)
+        finished = time.time()
+        reload_state.update(finished_at=finished, duration=round(finished - started, 3))
+
+def request_reload():
+    """Start a background reload without waiting for it"""
+    global reload_task, reload_pending
+    
+    reload_pending = True
+    if reload_task is None or reload_task.done():
+        reload_task = asyncio.create_task(run_reloads())
+
+def schedule_changed():
+    """Reload a schedule rewritten on disk, unless the backend's own EPG refresh is writing it
+    
+    The refresh serves the schedule it saved without reading it back and
+    marks the files as loaded when it is done. Reloading the files it writes
+    meanwhile would only parse them again. A refresh by ruvsarpur.py waits
+    for the lock, its files are picked up once the backend's refresh is over.
+    """
+    if running_epg_job() is None:
+        request_reload()
+
+async def reload_schedule() -> ScheduleSnapshot:
+    """Reload the schedule in the background and wait for the new snapshot
+    
+    Concurrent callers share one reload, a reload requested while another one
+    is running is done once the running one finishes.
+    """
+    request_reload()
+    await asyncio.shield(reload_task)
+    return snapshot
 
 app = FastAPI(title="RÚV Downloader API")
 
 # Mount static files for download access
 app.mount("/download", StaticFiles(directory="/app/downloads"), name="downloads")
 
-# Load schedule on startup
-load_schedule()
+def new_epg_job() -> Dict:
+    """Register an EPG refresh job, forgetting the oldest finished ones"""
+    finished = [job_id for job_id, job in epg_jobs.items() if job["status"] != "running"]
+    for job_id in finished[:max(0, len(finished) - EPG_JOBS_KEPT + 1)]:
+        del epg_jobs[job_id]
+    
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "status": "running",
+        "started_at": time.time(),
+        "finished_at": None,
+        "duration": None,
+        "schedule_items": None,
+        "message": None,
+        "progress": fetchengine.RefreshProgress(),
+        "task": None
+    }
+    epg_jobs[job["job_id"]] = job
+    return job
+
+def epg_job_report(job: Dict) -> Dict:
+    """The state of an EPG refresh job with its current progress counters"""
+    return {**{key: value for key, value in job.items() if key not in ("progress", "task")}, **job["progress"].report()}
+
+async def run_epg_refresh(job: Dict) -> Dict:
+    """Refresh the EPG for a job and start serving the refreshed schedule
+    
+    Returns the final report of the job.
+    """
+    try:
+        async with epg_refresh_lock:
+            logger.info(f"Starting EPG refresh job {job['job_id']}")
+            
+            # Without a schedule to serve yet, the series are served as they are downloaded
+            if reload_task is not None and not reload_task.done():
+                await asyncio.shield(reload_task)
+            publisher = SeriesPublisher(asyncio.get_running_loop()) if not snapshot.data else None
+            
+            # Download in a worker thread, searches keep using the old data meanwhile
+            loaded = await asyncio.to_thread(refresh_epg, job["progress"], publisher)
+            
+            # A reload started during the download read older files, let it finish before swapping
+            if reload_task is not None and not reload_task.done():
+                await asyncio.shield(reload_task)
+            install_snapshot(loaded)
+            job.update(status="success", schedule_items=len(loaded.data))
+        
+    except Exception as e:
+        logger.error(f"Error downloading EPG: {str(e)}", exc_info=True)
+        job.update(status="error", message=str(e))
+    
+    job["progress"].finish()
+    job.update(finished_at=time.time(), duration=round(time.time() - job["started_at"], 3))
+    return epg_job_report(job)
+
+def running_epg_job() -> Optional[Dict]:
+    """The EPG refresh job that is running, if any"""
+    if epg_job is not None and not epg_job["task"].done():
+        return epg_job
+    return None
+
+def start_epg_job() -> Tuple[Dict, bool]:
+    """Start an EPG refresh job, or attach to the one already running
+    
+    Returns the job and whether it was already running.
+    """
+    global epg_job
+    
+    if running_epg_job() is not None:
+        logger.info(f"Attaching to running EPG refresh job {epg_job['job_id']}")
+        return epg_job, True
+    
+    epg_job = new_epg_job()
+    epg_job["task"] = asyncio.create_task(run_epg_refresh(epg_job))
+    logger.info(f"Started EPG refresh job {epg_job['job_id']}")
+    return epg_job, False
+
+async def wait_for_epg_job(job: Dict) -> Dict:
+    """Wait for an EPG refresh job to finish, without cancelling it if the waiter is cancelled"""
+    return await asyncio.shield(job["task"])
 
 async def scheduled_epg_refresh():
-    """Background task that refreshes EPG data every 2 hours"""
+    """Background task that refreshes EPG data at startup and every 2 hours when it is missing or old"""
     while True:
         try:
-            await asyncio.sleep(EPG_REFRESH_INTERVAL)
             logger.info("Starting scheduled EPG refresh")
             
             # Check if EPG data needs refreshing
-            epg_locations = [
-                "/home/appuser/.ruvsarpur/tvschedule.json",
-                "/app/data/.ruvsarpur/tvschedule.json",
-                "/root/.ruvsarpur/tvschedule.json",
-                "/app/.ruvsarpur/tvschedule.json"
-            ]
-            
-            epg_file = None
-            for location in epg_locations:
-                if os.path.exists(location):
-                    epg_file = location
-                    break
+            schedule_source.refresh()
             
             should_refresh = False
-            if epg_file:
-                # Check file age
-                import time
-                file_age_seconds = time.time() - os.path.getmtime(epg_file)
+            refreshed_at = schedulefile.last_refreshed(schedule_source.path) if schedule_source.exists else None
+            if refreshed_at is not None:
+                # Check the age of the last refresh, incremental refreshes leave the json file itself alone
+                file_age_seconds = time.time() - refreshed_at
                 file_age_hours = file_age_seconds / 3600
                 logger.info(f"EPG data is {file_age_hours:.1f} hours old")
                 
@@ -120,8 +487,8 @@ async def scheduled_epg_refresh():
                 logger.info("No EPG data found, triggering refresh")
             
             if should_refresh:
-                # Call the existing EPG refresh function
-                result = await download_epg()
+                job, _ = start_epg_job()
+                result = await wait_for_epg_job(job)
                 if result.get("status") == "success":
                     logger.info(f"Scheduled EPG refresh completed successfully. Items: {result.get('schedule_items', 0)}")
                 else:
@@ -130,12 +497,19 @@ async def scheduled_epg_refresh():
         except Exception as e:
             logger.error(f"Error in scheduled EPG refresh: {str(e)}", exc_info=True)
             # Continue the loop even if there's an error
+        
+        await asyncio.sleep(EPG_REFRESH_INTERVAL)
 
 @app.on_event("startup")
 async def startup_event():
     """Start background tasks when the app starts"""
+    # Load the schedule without holding up startup, searches answer 503 until it is in
+    request_reload()
+    # Refreshes right away when there is no schedule or it is old, a missing one is served series by series as it downloads
     logger.info("Starting EPG refresh background task")
     asyncio.create_task(scheduled_epg_refresh())
+    # Reload whenever the schedule is rewritten outside the backend, e.g. by ruvsarpur.py
+    asyncio.create_task(schedule_source.watch(schedule_changed, SCHEDULE_POLL_INTERVAL))
 
 # Global dictionary to track download status
 download_status: Dict[str, Dict] = {}
@@ -167,98 +541,232 @@ class DownloadRequest(BaseModel):
         # Ensure we always have an absolute path
         return os.path.abspath(value)
 
+def parse_cursor(cursor: Optional[str]) -> int:
+    """Turn a pagination cursor back into a result offset"""
+    if not cursor:
+        return 0
+    try:
+        offset = int(cursor)
+    except ValueError:
+        offset = -1
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset
+
+def page_body(fragments: List[bytes], total: int, next_offset: int, extra: bytes = b'') -> bytes:
+    """Join pre-serialized result fragments into a paginated JSON body"""
+    next_cursor = str(next_offset) if next_offset < total else None
+    return b''.join((
+        b'{',
+        extra,
+        b'"results":[',
+        b','.join(fragments),
+        b'],"total":',
+        str(total).encode(),
+        b',"next_cursor":',
+        json.dumps(next_cursor).encode(),
+        b'}'
+    ))
+
+def schedule_etag(request: Request, current: ScheduleSnapshot) -> str:
+    """ETag for responses that only depend on the loaded schedule and the request URL"""
+    url_hash = hashlib.blake2b(str(request.url).encode(), digest_size=8).hexdigest()
+    return f'W/"{SCHEDULE_ETAG_PREFIX}-{current.version}-{url_hash}"'
+
+def loaded_snapshot() -> ScheduleSnapshot:
+    """Return the current snapshot, raise 503 (and start a reload) if no schedule is loaded"""
+    current = snapshot
+    if not current.data:
+        # While a refresh downloads a missing schedule there is no file to reload, its series are published as they arrive
+        downloading = running_epg_job() is not None and not schedule_source.exists
+        if reload_state["state"] != "loading" and not downloading:
+            request_reload()
+        raise HTTPException(status_code=503, detail="Schedule data not available")
+    return current
+
+class FacetFilters(BaseModel):
+    flags: Dict[str, bool] = {}
+    categories: List[str] = []
+
+def facet_filters(
+    is_movie: Optional[bool] = None,
+    is_sport: Optional[bool] = None,
+    is_docu: Optional[bool] = None,
+    has_subtitles: Optional[bool] = None,
+    english_subtitled: Optional[bool] = None,
+    category: Optional[List[str]] = Query(None)
+) -> FacetFilters:
+    """Collect the facet filter query parameters shared by search and browse"""
+    flags = {
+        'is_movie': is_movie,
+        'is_sport': is_sport,
+        'is_docu': is_docu,
+        'has_subtitles': has_subtitles,
+        'english_subtitled': english_subtitled,
+    }
+    return FacetFilters(
+        flags={flag: wanted for flag, wanted in flags.items() if wanted is not None},
+        categories=category or []
+    )
+
+def ranked_page_body(search_index: SearchIndex, ranks: Dict[int, int], offset: int, limit: int, group: Optional[str], facets: FacetFilters) -> bytes:
+    """Apply facet filters to ranked items and serialize the requested page with facet counts"""
+    ranks = search_index.filter_ranks(ranks, search_index.facet_mask(facets.flags, facets.categories))
+    extra = b'"facets":' + encode_json(search_index.facet_counts(ranks)) + b','
+    
+    # Results were serialized when the index was built, the response is a join of those fragments
+    if group == 'series':
+        groups = search_index.group(ranks)
+        page = search_index.top_series(ranks, groups, offset, limit)
+        fragments = [search_index.series_card(series_id, groups[series_id]) for series_id in page]
+        return page_body(fragments, len(groups), offset + limit, extra=extra)
+    
+    page = search_index.top(ranks, offset, limit)
+    return page_body([search_index.payloads[item_id] for item_id in page], len(ranks), offset + limit, extra=extra)
+
 @app.get("/api/search/{query}")
-async def search_shows(query: str):
-    """Search for shows in the loaded schedule data"""
+async def search_shows(
+    request: Request,
+    query: str,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    group: Optional[str] = Query(None, pattern="^series$"),
+    fuzzy: bool = False,
+    facets: FacetFilters = Depends(facet_filters)
+):
+    """Search for shows in the loaded schedule data, one ranked page at a time
+    
+    With group=series every page entry is a series card holding the number of
+    matching episodes and the newest of them instead of individual episodes.
+    With fuzzy=true titles that only fuzzily match the query (typos, missing
+    accents) are appended below the exact matches. Facet filters narrow the
+    matches down and the response carries facet counts for the matches.
+    """
+    offset = parse_cursor(cursor)
+    current = loaded_snapshot()
+    
+    # The answer only changes with the schedule, so a matching ETag skips the search entirely
+    etag = schedule_etag(request, current)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
     try:
-        logger.info(f"Searching for: {query}")
-        
-        if not schedule_data:
-            # Try to reload if empty
-            load_schedule()
-            if not schedule_data:
-                raise HTTPException(status_code=503, detail="Schedule data not available")
+        logger.info(f"Searching for: {query} (offset {offset}, limit {limit}, group {group}, fuzzy {fuzzy}, facets {facets})")
         
-        results = []
-        query_lower = query.lower()
+        # Rank every match (or reuse the cached ranking), then only pick the requested page
+        cache_key = (normalize_query(query), fuzzy, current.version)
+        ranks = search_cache.get(cache_key)
+        if ranks is None:
+            ranks = current.index.search(query)
+            if fuzzy:
+                # Exact matches always outrank fuzzy ones
+                ranks = {**current.index.fuzzy_search(query), **ranks}
+            search_cache.put(cache_key, ranks)
+        logger.info(f"Found {len(ranks)} results")
         
-        # Search through all items in the schedule
-        for pid, item in schedule_data.items():
-            try:
-                if pid == 'date' or not isinstance(item, dict):
-                    continue
-                
-                # Search in multiple fields
-                searchable_texts = [
-                    item.get('title', ''),
-                    item.get('series_title', ''),
-                    item.get('episode_title', ''),
-                    item.get('desc', ''),
-                    item.get('series_desc', ''),
-                    item.get('series_sdesc', ''),
-                    item.get('original-title', '') or ''
-                ]
-                
-                # Check if query matches any of the searchable fields
-                found = any(query_lower in text.lower() for text in searchable_texts if text)
-                
-                if found:
-                    # Create rich result object
-                    result = {
-                        'pid': pid,
-                        'title': item.get('title', ''),
-                        'description': item.get('desc', ''),
-                        'duration': item.get('duration_friendly', ''),
-                        'image': item.get('portrait_image') or item.get('series_image') or item.get('episode_image') or '',
-                        'has_subtitles': item.get('has_subtitles', False),
-                        'is_movie': item.get('is_movie', False),
-                        'is_sport': item.get('is_sport', False),
-                        'is_docu': item.get('is_docu', False),
-                        'showtime': item.get('showtime', ''),
-                        'series_title': item.get('series_title', ''),
-                        'episode_title': item.get('episode_title', ''),
-                        'series_desc': item.get('series_sdesc', ''),
-                    }
-                    
-                    # Add episode info if available
-                    if item.get('ep_num') and item.get('ep_total'):
-                        result['episode_info'] = f"Episode {item['ep_num']} of {item['ep_total']}"
-                        result['episode_number'] = item['ep_num']
-                        result['total_episodes'] = item['ep_total']
-                    
-                    # Add original title if available
-                    if item.get('original-title'):
-                        result['original_title'] = item['original-title']
-                    
-                    # Add series ID for grouping
-                    if item.get('sid'):
-                        result['series_id'] = item['sid']
-                    
-                    results.append(result)
-                    
-            except Exception as item_error:
-                logger.error(f"Error processing item {pid}: {str(item_error)}")
-                continue
-        
-        # Sort results by series and episode number
-        results.sort(key=lambda x: (
-            x.get('series_title', ''),
-            int(x.get('episode_number', 0)) if x.get('episode_number') else 0
-        ))
-        
-        logger.info(f"Found {len(results)} results")
-        return results
+        return json_response(request, ranked_page_body(current.index, ranks, offset, limit, group, facets), etag)
         
     except Exception as e:
         logger.error(f"Search error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/browse")
+async def browse_shows(
+    request: Request,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    group: Optional[str] = Query(None, pattern="^series$"),
+    facets: FacetFilters = Depends(facet_filters)
+):
+    """Browse the schedule by facet filters alone, ordered by series and episode"""
+    offset = parse_cursor(cursor)
+    current = loaded_snapshot()
+    
+    etag = schedule_etag(request, current)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
+    try:
+        mask = current.index.facet_mask(facets.flags, facets.categories)
+        item_ids = ids_from_bitmap(current.index.all_items if mask is None else mask)
+        body = ranked_page_body(current.index, dict.fromkeys(item_ids, 0), offset, limit, group, FacetFilters())
+        return json_response(request, body, etag)
+        
+    except Exception as e:
+        logger.error(f"Browse error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/suggest")
+async def suggest_titles(
+    request: Request,
+    prefix: str = "",
+    limit: int = Query(SUGGEST_DEFAULT_LIMIT, ge=1, le=SUGGEST_MAX_LIMIT)
+):
+    """Suggest series and original titles starting with a prefix"""
+    current = snapshot
+    etag = schedule_etag(request, current)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    return json_response(request, encode_json({"suggestions": current.index.suggest(prefix, limit)}), etag)
+
+@app.get("/api/series/{sid}/episodes")
+async def get_series_episodes(
+    request: Request,
+    sid: str,
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT),
+    cursor: Optional[str] = None
+):
+    """List the episodes of a series, newest first, one page at a time"""
+    offset = parse_cursor(cursor)
+    current = loaded_snapshot()
+    
+    series_id = current.index.find_series(sid.strip())
+    if series_id is None:
+        raise HTTPException(status_code=404, detail="Series not found")
+    
+    etag = schedule_etag(request, current)
+    cached = not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
+    episodes = current.index.series_episodes(series_id)
+    page = episodes[offset:offset + limit]
+    body = page_body(
+        [current.index.payloads[item_id] for item_id in page],
+        len(episodes),
+        offset + limit,
+        extra=b'"series":' + current.index.series_header(series_id) + b','
+    )
+    return json_response(request, body, etag)
+
+@app.get("/api/search-cache")
+async def get_search_cache_stats():
+    """Report search result cache statistics"""
+    return {"schedule_version": snapshot.version, **search_cache.stats()}
+
+@app.get("/api/reload-status")
+async def get_reload_status():
+    """Report the state of the background schedule reload and the snapshot being served"""
+    return {
+        **reload_state,
+        "schedule_version": snapshot.version,
+        "schedule_items": len(snapshot.index),
+        "schedule_partial": snapshot.partial
+    }
+
 @app.get("/api/refresh")
 async def refresh_schedule():
     """Manually refresh the schedule data"""
     try:
-        load_schedule()
-        return {"status": "success", "items": len(schedule_data)}
+        current = await reload_schedule()
+        if reload_state["state"] == "failed":
+            raise HTTPException(status_code=500, detail=reload_state["error"])
+        return {"status": "success", "items": len(current.data)}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Refresh error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -268,15 +776,8 @@ async def download_show_task(pid: str, quality: str, output_dir: str):
     try:
         logger.info(f"Starting download for PID: {pid}")
         
-        # Check if EPG data is available before starting
-        epg_locations = [
-            "/home/appuser/.ruvsarpur/tvschedule.json",         # Primary location (appuser)
-            "/app/data/.ruvsarpur/tvschedule.json",             # Fallback location  
-            "/root/.ruvsarpur/tvschedule.json",                 # Secondary location
-            "/app/.ruvsarpur/tvschedule.json"                   # Legacy location
-        ]
-        
-        epg_found = any(os.path.exists(location) for location in epg_locations)
+        # Check if EPG data is available before starting, the watcher keeps this current
+        epg_found = schedule_source.exists
         
         if epg_found:
             download_status[pid] = {"status": "downloading", "file_path": None}
@@ -286,6 +787,10 @@ async def download_show_task(pid: str, quality: str, output_dir: str):
                 "file_path": None,
                 "message": "Downloading EPG data first (may take 5-8 minutes)..."
             }
+            # Share the backend's refresh rather than have ruvsarpur.py download the schedule on its own
+            result = await wait_for_epg_job(start_epg_job()[0])
+            if result["status"] != "success":
+                logger.warning(f"EPG refresh before download failed: {result.get('message')}")
         
         # Ensure we have the absolute path
         abs_output_dir = os.path.abspath(output_dir)
@@ -396,7 +901,7 @@ async def download_show(request: DownloadRequest, background_tasks: BackgroundTa
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/status/{pid}")
-async def get_status(pid: str):
+async def get_status(request: Request, pid: str):
     """Get the status of a download"""
     stripped_pid = pid.strip()
     logger.debug(f"Status check for PID: '{stripped_pid}' (original: '{pid}', type: {type(stripped_pid)}).")
@@ -407,41 +912,31 @@ async def get_status(pid: str):
         raise HTTPException(status_code=404, detail="Download not found")
     
     logger.debug(f"PID '{stripped_pid}' found. Status: {download_status[stripped_pid]}")
-    return download_status[stripped_pid]
+    return json_response(request, encode_json(download_status[stripped_pid]))
 
 @app.get("/api/epg-status")
-async def get_epg_status():
+async def get_epg_status(request: Request):
     """Check EPG data availability"""
     try:
-        # Check multiple locations for EPG data
-        epg_locations = [
-            "/home/appuser/.ruvsarpur/tvschedule.json",         # Primary location (appuser)
-            "/app/data/.ruvsarpur/tvschedule.json",             # Fallback location
-            "/root/.ruvsarpur/tvschedule.json",                 # Secondary location
-            "/app/.ruvsarpur/tvschedule.json"                   # Legacy location
-        ]
-        
-        epg_found = False
-        epg_location = None
-        epg_size = 0
-        epg_modified = None
-        
-        for location in epg_locations:
-            if os.path.exists(location):
-                epg_found = True
-                epg_location = location
-                stat = os.stat(location)
-                epg_size = stat.st_size
-                epg_modified = stat.st_mtime
-                break
+        # The resolved schedule file and its stat result are kept current by the watcher
+        stat = schedule_source.stat
+        epg_size = stat.st_size if stat else 0
+        epg_modified = schedulefile.last_refreshed(schedule_source.path) if stat else None
         
-        return {
-            "epg_available": epg_found,
-            "epg_location": epg_location,
+        # The sidecar written with the schedule describes it without parsing it
+        meta = schedulefile.read_meta(schedule_source.path) if schedule_source.exists else None
+        
+        return json_response(request, encode_json({
+            "epg_available": schedule_source.exists,
+            "epg_location": schedule_source.path,
             "epg_size_mb": round(epg_size / (1024 * 1024), 2) if epg_size > 0 else 0,
             "epg_last_modified": epg_modified,
-            "schedule_items": len(schedule_data) if schedule_data else 0
-        }
+            "epg_items": meta.get("items") if meta else None,
+            "epg_version": meta.get("version") if meta else None,
+            "schedule_items": len(snapshot.data),
+            "schedule_partial": snapshot.partial,
+            "refresh_job": epg_job["job_id"] if running_epg_job() is not None else None
+        }))
         
     except Exception as e:
         logger.error(f"Error checking EPG status: {str(e)}")
@@ -452,55 +947,29 @@ async def get_epg_status():
 
 @app.post("/api/download-epg")
 async def download_epg():
-    """Manually trigger EPG download"""
-    try:
-        python_executable = os.path.join(os.path.dirname(sys.executable), "python3")
-        if not os.path.exists(python_executable):
-            python_executable = sys.executable
-        
-        # Create EPG directory in appuser's home (mounted from host)
-        os.makedirs("/home/appuser/.ruvsarpur", exist_ok=True)
-        
-        # Run ruvsarpur with --refresh flag to explicitly refresh EPG data
-        cmd = [python_executable, RUVSARPUR_SCRIPT, "--refresh", "--list"]
-        
-        logger.info(f"Triggering EPG download with command: {' '.join(cmd)}")
-        
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-            cwd=RUVSARPUR_PATH
-        )
-        
-        try:
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(), 
-                timeout=600  # 10 minutes timeout for EPG download
-            )
-        except asyncio.TimeoutError:
-            return {
-                "status": "error",
-                "message": "EPG download timed out after 10 minutes"
-            }
-        
-        # Reload schedule data after EPG download
-        load_schedule()
-        
-        return {
-            "status": "success" if process.returncode == 0 else "error",
-            "return_code": process.returncode,
-            "stdout": stdout.decode('utf-8') if stdout else "",
-            "stderr": stderr.decode('utf-8') if stderr else "",
-            "schedule_items": len(schedule_data)
-        }
-        
-    except Exception as e:
-        logger.error(f"Error downloading EPG: {str(e)}", exc_info=True)
-        return {
-            "status": "error",
-            "message": str(e)
-        }
+    """Start an EPG refresh job, its progress is reported by /api/download-epg/{job_id}
+    
+    While a refresh is running the running job is returned instead of starting another one.
+    """
+    job, attached = start_epg_job()
+    return {
+        "status": "started",
+        "attached": attached,
+        "job_id": job["job_id"],
+        "status_url": f"/api/download-epg/{job['job_id']}"
+    }
+
+@app.get("/api/download-epg/{job_id}")
+async def get_epg_job(job_id: str):
+    """Report the progress of an EPG refresh job
+    
+    Includes the series downloaded out of the total, the request rate, the
+    errors and the estimated seconds left while the job runs.
+    """
+    job = epg_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="EPG refresh job not found")
+    return epg_job_report(job)
 
 @app.get("/api/test-ruvsarpur")
 async def test_ruvsarpur():
@@ -0,0 +1,114 @@
+"""
+Compact in-memory form of the TV schedule.
+
+Every schedule entry written by ruvsarpur.py repeats the series level fields
+of its series and carries raw API data (the episode dict, imdb data, file and
+subtitle references) that the backend never reads. The backend keeps one
+shared Series record per distinct set of series fields and a slotted Episode
+per entry holding only the fields the search index uses.
+"""
+import sys
+from typing import Dict, Tuple
+
+# Schedule fields that are the same for all episodes of a series. Sport
+# series get the year appended to their title, so records are shared by
+# value rather than by sid.
+SERIES_FIELDS = (
+    'series_title', 'series_desc', 'series_sdesc', 'series_image', 'portrait_image',
+    'original-title', 'categories', 'is_movie', 'is_sport', 'is_docu', 'english_subtitled'
+)
+
+# Per episode fields used by the backend, everything else is dropped
+EPISODE_FIELDS = (
+    'pid', 'sid', 'title', 'episode_title', 'desc', 'showtime', 'duration_friendly',
+    'episode_image', 'has_subtitles', 'ep_num', 'ep_total'
+)
+
+# Short strings repeated across many episodes, interned so they are stored once
+INTERNED_FIELDS = ('sid', 'episode_title', 'duration_friendly', 'episode_image', 'ep_num', 'ep_total', 'showtime')
+
+
+def _attribute(field: str) -> str:
+    return field.replace('-', '_')
+
+
+class Series:
+    """Series level fields shared by all episodes with the same values"""
+    __slots__ = tuple(_attribute(field) for field in SERIES_FIELDS)
+
+
+class Episode:
+    """A schedule entry without the repeated series fields and the raw API data
+
+    get() mirrors dict.get on the original entry, fields that were missing
+    from the entry are left unset and return the default.
+    """
+    __slots__ = tuple(_attribute(field) for field in EPISODE_FIELDS) + ('series',)
+
+    def get(self, field: str, default=None):
+        name = _ATTRIBUTES.get(field)
+        if name is None:
+            return default
+        owner = self.series if field in _SERIES_FIELD_SET else self
+        return getattr(owner, name, default)
+
+    def __getitem__(self, field: str):
+        value = self.get(field, _MISSING)
+        if value is _MISSING:
+            raise KeyError(field)
+        return value
+
+
+_ATTRIBUTES = {field: _attribute(field) for field in SERIES_FIELDS + EPISODE_FIELDS}
+_SERIES_FIELD_SET = frozenset(SERIES_FIELDS)
+_INTERNED_FIELD_SET = frozenset(INTERNED_FIELDS)
+_MISSING = object()
+
+
+def _series_key(item: Dict) -> Tuple:
+    key = []
+    for field in SERIES_FIELDS:
+        value = item.get(field, _MISSING)
+        if isinstance(value, list):
+            value = tuple(value)
+        key.append(value)
+    return tuple(key)
+
+
+def compact_schedule(schedule: Dict) -> Dict[str, Episode]:
+    """Convert a parsed tvschedule.json into Episodes keyed by pid
+
+    The 'date' entry and anything that is not a schedule item are left out.
+    """
+    compact: Dict[str, Episode] = {}
+    series_records: Dict[Tuple, Series] = {}
+
+    for pid, item in schedule.items():
+        if pid == 'date' or not isinstance(item, dict):
+            continue
+
+        key = _series_key(item)
+        series = series_records.get(key)
+        if series is None:
+            series = series_records[key] = Series()
+            for field, value in zip(SERIES_FIELDS, key):
+                if value is _MISSING:
+                    continue
+                if isinstance(value, str):
+                    value = sys.intern(value)
+                elif isinstance(value, tuple):
+                    value = tuple(sys.intern(part) if isinstance(part, str) else part for part in value)
+                setattr(series, _ATTRIBUTES[field], value)
+
+        episode = Episode()
+        episode.series = series
+        for field in EPISODE_FIELDS:
+            value = item.get(field, _MISSING)
+            if value is _MISSING:
+                continue
+            if field in _INTERNED_FIELD_SET and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(episode, _ATTRIBUTES[field], value)
+        compact[sys.intern(pid)] = episode
+
+    return compact
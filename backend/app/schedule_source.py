@@ -0,0 +1,146 @@
+"""
+Resolution and change detection for the schedule file.
+
+The schedule can live in one of several locations and is rewritten out of
+band by ruvsarpur.py. ScheduleSource resolves the location once, keeps the
+stat result of the file (and of its change journal and the optional schedule
+database) cached and watches for changes, with inotify through watchfiles when it is installed and
+a plain stat poll otherwise.
+"""
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+try:
+    from watchfiles import awatch
+except ImportError:  # watchfiles comes with uvicorn[standard], polling works without it
+    awatch = None
+
+logger = logging.getLogger(__name__)
+
+# Identifies one version of a file, None when the file does not exist
+FileSignature = Optional[Tuple[int, int, int]]
+
+
+def _signature(stat: Optional[os.stat_result]) -> FileSignature:
+    if stat is None:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _stat(path: Optional[str]) -> Optional[os.stat_result]:
+    if path is None:
+        return None
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+class ScheduleSource:
+    """The schedule file location, its cached stat result and a change watcher
+
+    Args:
+        candidates: Possible schedule file locations in order of preference.
+        db_file: Location of the optional schedule database.
+        journal_suffix: Appended to the schedule file name to get its journal file name.
+    """
+
+    def __init__(self, candidates: List[str], db_file: Optional[str] = None, journal_suffix: Optional[str] = None):
+        self.candidates = candidates
+        self.db_file = db_file
+        self.journal_suffix = journal_suffix
+        self.path: Optional[str] = None
+        self.stat: Optional[os.stat_result] = None
+        self.db_stat: Optional[os.stat_result] = None
+        self.journal_stat: Optional[os.stat_result] = None
+        # Signature of the files the served schedule was loaded from
+        self.loaded: Tuple = (None, None, None, None)
+        self.refresh()
+
+    def _resolve(self):
+        for location in self.candidates:
+            stat = _stat(location)
+            if stat is not None:
+                self.path, self.stat = location, stat
+                return
+        self.path, self.stat = None, None
+
+    def refresh(self) -> Tuple:
+        """Re-stat the files, re-resolving the location only if the file went away"""
+        self.stat = _stat(self.path)
+        if self.stat is None:
+            self._resolve()
+        self.db_stat = _stat(self.db_file)
+        self.journal_stat = _stat(self.journal_path)
+        return self.signature()
+
+    def signature(self) -> Tuple:
+        """The schedule path and the versions of the schedule, database and journal files"""
+        return (self.path, _signature(self.stat), _signature(self.db_stat), _signature(self.journal_stat))
+
+    @property
+    def journal_path(self) -> Optional[str]:
+        if self.path is None or not self.journal_suffix:
+            return None
+        return self.path + self.journal_suffix
+
+    @property
+    def exists(self) -> bool:
+        return self.path is not None
+
+    def changed(self) -> bool:
+        """Check whether the files differ from the ones the schedule was loaded from"""
+        return self.refresh() != self.loaded
+
+    def _watched_directories(self) -> List[str]:
+        directories = {os.path.dirname(location) for location in self.candidates}
+        if self.db_file:
+            directories.add(os.path.dirname(self.db_file))
+        return sorted(directory for directory in directories if os.path.isdir(directory))
+
+    def _watched_names(self) -> set:
+        names = set(self.candidates)
+        if self.journal_suffix:
+            names.update(location + self.journal_suffix for location in self.candidates)
+        if self.db_file:
+            names.add(self.db_file)
+        return {os.path.abspath(name) for name in names}
+
+    async def _ticks(self, interval: float):
+        """Yield whenever a watched file may have changed, and at least every interval"""
+        directories = self._watched_directories()
+        if awatch is not None and directories:
+            logger.info(f"Watching {directories} for schedule changes")
+            names = self._watched_names()
+            async for _ in awatch(
+                *directories,
+                watch_filter=lambda change, path: os.path.abspath(path) in names,
+                rust_timeout=int(interval * 1000),
+                yield_on_timeout=True
+            ):
+                yield
+        else:
+            logger.info(f"Polling for schedule changes every {interval} seconds")
+            while True:
+                await asyncio.sleep(interval)
+                yield
+
+    async def watch(self, on_change: Callable[[], None], interval: float = 5.0, settle: float = 1.0):
+        """Call on_change whenever the schedule files changed since the last load
+
+        A change is only reported once the files stop changing for settle
+        seconds, so a file that is still being written is not loaded.
+        """
+        async for _ in self._ticks(interval):
+            try:
+                if not self.changed():
+                    continue
+                pending = self.signature()
+                await asyncio.sleep(settle)
+                if self.refresh() == pending:
+                    logger.info(f"Schedule changed on disk: {self.path}")
+                    on_change()
+            except Exception as e:
+                logger.error(f"Error watching the schedule: {str(e)}")
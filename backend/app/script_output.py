@@ -0,0 +1,106 @@
+"""
+Routing of the console output of ruvsarpur.py into the log.
+
+ruvsarpur.py is a command line script, it prints progress bars and summaries
+to stdout while it refreshes the schedule. When the backend calls it as a
+library that output would be interleaved with the server's own. ScriptOutput
+stands in for sys.stdout and sends what the capturing threads print to a
+logger, one line at a time, while every other thread keeps writing to the
+real stdout.
+"""
+import contextlib
+import io
+import logging
+import re
+import sys
+import threading
+from typing import Dict, Iterator, Optional
+
+# Terminal colour codes added by termcolor
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+class ScriptOutput(io.TextIOBase):
+    """A sys.stdout replacement logging the output of the capturing threads
+
+    Args:
+        stream: Where the output of every other thread goes.
+        logger: Receives the captured lines.
+        thread_prefix: Threads whose name starts with this are captured too,
+            the fetch engine's workers print from their own threads.
+    """
+
+    def __init__(self, stream, logger: logging.Logger, thread_prefix: Optional[str] = None):
+        self.stream = stream
+        self.logger = logger
+        self.thread_prefix = thread_prefix
+        self.captured = set()
+        # Partial lines per thread, waiting for their newline
+        self.pending: Dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    @property
+    def encoding(self):
+        return self.stream.encoding
+
+    def isatty(self) -> bool:
+        return self.stream.isatty()
+
+    def fileno(self) -> int:
+        return self.stream.fileno()
+
+    def _capturing(self) -> bool:
+        thread = threading.current_thread()
+        if thread.ident in self.captured:
+            return True
+        return bool(self.captured) and self.thread_prefix is not None and thread.name.startswith(self.thread_prefix)
+
+    def write(self, text: str) -> int:
+        if not self._capturing():
+            return self.stream.write(text)
+        ident = threading.get_ident()
+        with self.lock:
+            pending = self.pending.pop(ident, '')
+            # Text printed after a progress bar without a newline in between starts a line of its own
+            if pending.startswith('\r') and not text.startswith(('\r', '\n')):
+                pending += '\n'
+            lines = (pending + text).split('\n')
+            # Only the last redraw of a progress bar is kept, not every one since the last newline
+            rest = lines[-1][max(lines[-1].rfind('\r'), 0):]
+            if rest:
+                self.pending[ident] = rest
+        for line in lines[:-1]:
+            self._log(line)
+        return len(text)
+
+    def _log(self, line: str):
+        # A progress bar redraws itself after a carriage return, only its last state is logged
+        line = ANSI_ESCAPE.sub('', line.rsplit('\r', 1)[-1]).strip()
+        if line:
+            self.logger.debug(line)
+
+    def flush(self):
+        if not self._capturing():
+            self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self) -> Iterator[None]:
+        """Log what the current thread prints until the block ends"""
+        ident = threading.get_ident()
+        with self.lock:
+            self.captured.add(ident)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.captured.discard(ident)
+                rest = self.pending.pop(ident, '')
+            self._log(rest)
+
+
+def install(logger: logging.Logger, thread_prefix: Optional[str] = None) -> ScriptOutput:
+    """Put a ScriptOutput in place of sys.stdout, or return the one already installed"""
+    if isinstance(sys.stdout, ScriptOutput):
+        return sys.stdout
+    sys.stdout = ScriptOutput(sys.stdout, logger, thread_prefix)
+    return sys.stdout
@@ -0,0 +1,557 @@
+"""
+In-memory search index over the loaded TV schedule.
+"""
+import bisect
+import heapq
+import json
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+from fuzzywuzzy import fuzz
+
+from .schedule import Episode
+
+logger = logging.getLogger(__name__)
+
+# Schedule fields that take part in free text search, title fields rank
+# above description fields
+TITLE_FIELDS = ('title', 'series_title', 'episode_title', 'original-title')
+DESCRIPTION_FIELDS = ('desc', 'series_desc', 'series_sdesc')
+SEARCH_FIELDS = TITLE_FIELDS + DESCRIPTION_FIELDS
+
+# Relevance ranks, lower is better
+RANK_EXACT_TITLE = 0
+RANK_TITLE_PREFIX = 1
+RANK_TITLE = 2
+RANK_DESCRIPTION = 3
+# Fuzzy matches rank below every exact match, better scores first
+RANK_FUZZY = 4
+
+# Titles that take part in fuzzy matching, the same ones the CLI's --find uses
+FUZZY_FIELDS = ('series_title', 'original-title')
+# Same threshold as the CLI's --find
+FUZZY_MIN_SCORE = 85
+# Only the titles sharing the most trigrams with the query are scored
+FUZZY_SHORTLIST = 64
+FUZZY_MIN_QUERY_LENGTH = 3
+
+# Icelandic letters that do not decompose into an ASCII base letter
+_FOLD_TABLE = str.maketrans({'þ': 'th', 'ð': 'd', 'æ': 'ae', 'ø': 'o'})
+
+# Number of newest matching episodes embedded in a series card
+SERIES_CARD_EPISODES = 3
+
+# Prefix matches looked at when picking the most popular suggestions
+SUGGEST_SCAN_LIMIT = 2000
+
+# Boolean schedule flags available as facet filters
+FACET_FLAGS = ('is_movie', 'is_sport', 'is_docu', 'has_subtitles', 'english_subtitled')
+
+# Only the rarest few trigrams of a query are intersected, the remaining
+# candidates are verified with a plain substring check anyway
+MAX_INTERSECTED_GRAMS = 4
+
+
+def build_search_result(pid: str, item: Dict) -> Dict:
+    """Create the result object returned to the frontend for a schedule item"""
+    result = {
+        'pid': pid,
+        'title': item.get('title', ''),
+        'description': item.get('desc', ''),
+        'duration': item.get('duration_friendly', ''),
+        'image': item.get('portrait_image') or item.get('series_image') or item.get('episode_image') or '',
+        'has_subtitles': item.get('has_subtitles', False),
+        'is_movie': item.get('is_movie', False),
+        'is_sport': item.get('is_sport', False),
+        'is_docu': item.get('is_docu', False),
+        'showtime': item.get('showtime', ''),
+        'series_title': item.get('series_title', ''),
+        'episode_title': item.get('episode_title', ''),
+        'series_desc': item.get('series_sdesc', ''),
+    }
+
+    # Add episode info if available
+    if item.get('ep_num') and item.get('ep_total'):
+        result['episode_info'] = f"Episode {item['ep_num']} of {item['ep_total']}"
+        result['episode_number'] = item['ep_num']
+        result['total_episodes'] = item['ep_total']
+
+    # Add original title if available
+    if item.get('original-title'):
+        result['original_title'] = item['original-title']
+
+    # Add series ID for grouping
+    if item.get('sid'):
+        result['series_id'] = item['sid']
+
+    return result
+
+
+def build_series_card(sid: str, item: Dict, episode_count: int) -> Dict:
+    """Create the series level part of a grouped search result"""
+    card = {
+        'series_id': sid,
+        'series_title': item.get('series_title', '') or item.get('title', ''),
+        'series_desc': item.get('series_sdesc', ''),
+        'image': item.get('portrait_image') or item.get('series_image') or item.get('episode_image') or '',
+        'is_movie': item.get('is_movie', False),
+        'is_sport': item.get('is_sport', False),
+        'is_docu': item.get('is_docu', False),
+        'episode_count': episode_count,
+    }
+
+    if item.get('original-title'):
+        card['original_title'] = item['original-title']
+
+    return card
+
+
+def encode_json(value) -> bytes:
+    """Serialize a value the same way FastAPI's JSONResponse does"""
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query the same way for index lookups and cache keys"""
+    return unicodedata.normalize('NFC', query).lower()
+
+
+def fold_text(text: str) -> str:
+    """Lowercase and strip accents so that 'Frettir' matches 'Fréttir'"""
+    decomposed = unicodedata.normalize('NFKD', text.lower().translate(_FOLD_TABLE))
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(folded.split())
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def bitmap_from_ids(item_ids, size: int) -> int:
+    """Pack item ids into an integer bitset, bit n set for item n"""
+    packed = bytearray((size + 7) // 8)
+    for item_id in item_ids:
+        packed[item_id >> 3] |= 1 << (item_id & 7)
+    return int.from_bytes(packed, 'little')
+
+
+def ids_from_bitmap(bits: int) -> List[int]:
+    """Unpack an integer bitset into ascending item ids"""
+    item_ids = []
+    packed = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(packed):
+        while byte:
+            low_bit = byte & -byte
+            item_ids.append((byte_index << 3) + low_bit.bit_length() - 1)
+            byte ^= low_bit
+    return item_ids
+
+
+def _episode_number(item: Dict) -> int:
+    try:
+        return int(item.get('ep_num') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+class SearchIndex:
+    """Trigram index giving the same substring semantics as a linear scan.
+
+    Series level fields are repeated on every episode, so the index is built
+    over the distinct lowercased field values and each value maps back to the
+    schedule items that contain it. A query only verifies the texts that
+    share all of its rarest trigrams. Matches are ranked so that title hits
+    beat description hits and exact titles beat partial ones.
+
+    Fuzzy search works on the accent folded series and original titles. A
+    title shortlist is picked by trigram overlap with the query and only the
+    shortlist is scored with the partial ratio the CLI's --find uses (or the
+    plain ratio when that is higher, which favours whole title typos).
+
+    Title suggestions are served from a sorted array of the same folded
+    titles, a prefix maps to a contiguous range found by binary search.
+
+    Facet flags and categories are kept as integer bitsets over item ids so
+    filters combine with a few bitwise operations and facet counts are
+    popcounts.
+
+    The search result object of every item is built and serialized once
+    here, so a search response only joins precomputed JSON fragments. The
+    same goes for the series cards used when results are grouped by sid.
+    """
+
+    def __init__(self, schedule: Dict):
+        self.pids: List[str] = []
+        self.payloads: List[bytes] = []
+        self._sort_keys: List[Tuple[str, int]] = []
+        self._showtimes: List[str] = []
+        # Series of every item, items without a sid form a series of their own
+        self._item_series: array = array('I')
+        self.series_ids: List[str] = []
+        self._series_lookup: Dict[str, int] = {}
+        self._series_items: List[List[int]] = []
+        self._series_titles: List[str] = []
+        self._series_payloads: List[bytes] = []
+        self._texts: List[str] = []
+        # Items holding each text in a title field and in a description field
+        self._title_items: List[List[int]] = []
+        self._desc_items: List[List[int]] = []
+        self._postings: Dict[str, array] = {}
+        # Folded titles for fuzzy matching and their own trigram postings
+        self._fuzzy_titles: List[str] = []
+        self._fuzzy_display: List[str] = []
+        self._fuzzy_items: List[List[int]] = []
+        self._fuzzy_postings: Dict[str, array] = {}
+
+        # Facet bitsets, filled from the id lists below once all items are known
+        self.all_items = 0
+        self._flag_bits: Dict[str, int] = {}
+        self._category_bits: Dict[str, int] = {}
+        flag_items: Dict[str, List[int]] = {flag: [] for flag in FACET_FLAGS}
+        category_items: Dict[str, List[int]] = {}
+
+        text_ids: Dict[str, int] = {}
+        fuzzy_ids: Dict[str, int] = {}
+        series_first_items: List[Dict] = []
+        for pid, item in schedule.items():
+            if pid == 'date' or not isinstance(item, (dict, Episode)):
+                continue
+
+            try:
+                payload = encode_json(build_search_result(pid, item))
+            except Exception as item_error:
+                logger.error(f"Error processing item {pid}: {str(item_error)}")
+                continue
+
+            item_id = len(self.pids)
+            self.pids.append(pid)
+            self.payloads.append(payload)
+            self._sort_keys.append((item.get('series_title') or '', _episode_number(item)))
+            self._showtimes.append(item.get('showtime') or '')
+
+            sid = str(item.get('sid') or pid)
+            series_id = self._series_lookup.get(sid)
+            if series_id is None:
+                series_id = self._series_lookup[sid] = len(self.series_ids)
+                self.series_ids.append(sid)
+                self._series_items.append([])
+                series_first_items.append(item)
+            self._series_items[series_id].append(item_id)
+            self._item_series.append(series_id)
+
+            for flag in FACET_FLAGS:
+                if item.get(flag):
+                    flag_items[flag].append(item_id)
+            for category in item.get('categories') or ():
+                category_items.setdefault(category, []).append(item_id)
+
+            seen = set()
+            for field in SEARCH_FIELDS:
+                value = item.get(field)
+                if not value or not isinstance(value, str):
+                    continue
+                text = value.lower()
+                text_id = text_ids.get(text)
+                if text_id is None:
+                    text_id = len(self._texts)
+                    text_ids[text] = text_id
+                    self._texts.append(text)
+                    self._title_items.append([])
+                    self._desc_items.append([])
+                    for gram in _trigrams(text):
+                        posting = self._postings.get(gram)
+                        if posting is None:
+                            posting = self._postings[gram] = array('I')
+                        posting.append(text_id)
+                is_title = field in TITLE_FIELDS
+                if (text_id, is_title) not in seen:
+                    seen.add((text_id, is_title))
+                    if is_title:
+                        self._title_items[text_id].append(item_id)
+                    else:
+                        self._desc_items[text_id].append(item_id)
+
+            for field in FUZZY_FIELDS:
+                value = item.get(field)
+                if not value or not isinstance(value, str):
+                    continue
+                title = fold_text(value)
+                fuzzy_id = fuzzy_ids.get(title)
+                if fuzzy_id is None:
+                    fuzzy_id = fuzzy_ids[title] = len(self._fuzzy_titles)
+                    self._fuzzy_titles.append(title)
+                    self._fuzzy_display.append(value.strip())
+                    self._fuzzy_items.append([])
+                    for gram in _trigrams(title):
+                        posting = self._fuzzy_postings.get(gram)
+                        if posting is None:
+                            posting = self._fuzzy_postings[gram] = array('I')
+                        posting.append(fuzzy_id)
+                fuzzy_items = self._fuzzy_items[fuzzy_id]
+                if not fuzzy_items or fuzzy_items[-1] != item_id:
+                    fuzzy_items.append(item_id)
+
+        # Suggestions come from the folded titles kept in sorted order
+        self._suggest_ids = sorted(range(len(self._fuzzy_titles)), key=self._fuzzy_titles.__getitem__)
+        self._suggest_keys = [self._fuzzy_titles[fuzzy_id] for fuzzy_id in self._suggest_ids]
+
+        size = len(self.pids)
+        self.all_items = (1 << size) - 1
+        for flag, item_ids in flag_items.items():
+            self._flag_bits[flag] = bitmap_from_ids(item_ids, size)
+        for category, item_ids in sorted(category_items.items()):
+            self._category_bits[category] = bitmap_from_ids(item_ids, size)
+
+        # Episodes of a series are kept newest first for drilling into a series
+        showtimes = self._showtimes
+        for series_id, item_ids in enumerate(self._series_items):
+            item_ids.sort(key=lambda item_id: showtimes[item_id], reverse=True)
+            card = build_series_card(self.series_ids[series_id], series_first_items[series_id], len(item_ids))
+            self._series_titles.append(card['series_title'])
+            self._series_payloads.append(encode_json(card))
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def _candidate_texts(self, query: str):
+        """Return text ids that may contain the query, or None for all texts"""
+        if len(query) < 3:
+            return None
+
+        postings = []
+        for gram in _trigrams(query):
+            posting = self._postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:MAX_INTERSECTED_GRAMS]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query: str) -> Dict[int, int]:
+        """Return the ids of all items containing the query mapped to their rank"""
+        query_lower = normalize_query(query)
+        if not query_lower:
+            return {}
+
+        candidates = self._candidate_texts(query_lower)
+        if candidates is None:
+            candidates = range(len(self._texts))
+
+        texts = self._texts
+        ranks: Dict[int, int] = {}
+        for text_id in candidates:
+            text = texts[text_id]
+            if query_lower not in text:
+                continue
+
+            for item_id in self._desc_items[text_id]:
+                ranks.setdefault(item_id, RANK_DESCRIPTION)
+
+            if text == query_lower:
+                rank = RANK_EXACT_TITLE
+            elif text.startswith(query_lower):
+                rank = RANK_TITLE_PREFIX
+            else:
+                rank = RANK_TITLE
+            for item_id in self._title_items[text_id]:
+                if rank < ranks.get(item_id, RANK_DESCRIPTION + 1):
+                    ranks[item_id] = rank
+        return ranks
+
+    def fuzzy_search(self, query: str) -> Dict[int, int]:
+        """Return the ids of items with a title fuzzily matching the query mapped to their rank"""
+        query_folded = fold_text(query)
+        if len(query_folded) < FUZZY_MIN_QUERY_LENGTH:
+            return {}
+
+        overlaps: Dict[int, int] = {}
+        for gram in _trigrams(query_folded):
+            for fuzzy_id in self._fuzzy_postings.get(gram, ()):
+                overlaps[fuzzy_id] = overlaps.get(fuzzy_id, 0) + 1
+
+        shortlist = heapq.nlargest(FUZZY_SHORTLIST, overlaps.items(), key=lambda entry: entry[1])
+
+        ranks: Dict[int, int] = {}
+        for fuzzy_id, _ in shortlist:
+            title = self._fuzzy_titles[fuzzy_id]
+            score = max(fuzz.partial_ratio(query_folded, title), fuzz.ratio(query_folded, title))
+            if score <= FUZZY_MIN_SCORE:
+                continue
+            rank = RANK_FUZZY + 100 - score
+            for item_id in self._fuzzy_items[fuzzy_id]:
+                if rank < ranks.get(item_id, rank + 1):
+                    ranks[item_id] = rank
+        return ranks
+
+    def suggest(self, prefix: str, limit: int) -> List[Dict]:
+        """Return the titles starting with a prefix, the ones with most episodes first"""
+        prefix_folded = fold_text(prefix)
+        if not prefix_folded:
+            return []
+
+        start = bisect.bisect_left(self._suggest_keys, prefix_folded)
+        end = bisect.bisect_left(self._suggest_keys, prefix_folded + '\U0010ffff', start)
+        candidates = self._suggest_ids[start:min(end, start + SUGGEST_SCAN_LIMIT)]
+        fuzzy_items = self._fuzzy_items
+        best = heapq.nlargest(limit, candidates, key=lambda fuzzy_id: len(fuzzy_items[fuzzy_id]))
+        return [
+            {'title': self._fuzzy_display[fuzzy_id], 'episodes': len(fuzzy_items[fuzzy_id])}
+            for fuzzy_id in best
+        ]
+
+    def facet_mask(self, flags: Dict[str, bool], categories: List[str]) -> Optional[int]:
+        """Combine facet filters into a bitset, None when nothing is filtered
+
+        Flags set to False exclude the flagged items, several categories
+        match items in any of them.
+        """
+        if not flags and not categories:
+            return None
+
+        mask = self.all_items
+        for flag, wanted in flags.items():
+            bits = self._flag_bits.get(flag, 0)
+            mask &= bits if wanted else ~bits
+        if categories:
+            any_category = 0
+            for category in categories:
+                any_category |= self._category_bits.get(category, 0)
+            mask &= any_category
+        return mask & self.all_items
+
+    def filter_ranks(self, ranks: Dict[int, int], mask: Optional[int]) -> Dict[int, int]:
+        """Drop ranked items outside of a facet mask"""
+        if mask is None:
+            return ranks
+        packed = mask.to_bytes((len(self.pids) + 7) // 8, 'little')
+        return {
+            item_id: rank for item_id, rank in ranks.items()
+            if packed[item_id >> 3] >> (item_id & 7) & 1
+        }
+
+    def facet_counts(self, item_ids) -> Dict:
+        """Count how many of the given items fall into every facet"""
+        bits = bitmap_from_ids(item_ids, len(self.pids))
+        counts = {flag: (bits & flag_bits).bit_count() for flag, flag_bits in self._flag_bits.items()}
+        counts['categories'] = {
+            category: count for category, category_bits in self._category_bits.items()
+            if (count := (bits & category_bits).bit_count())
+        }
+        return counts
+
+    def top(self, ranks: Dict[int, int], offset: int, limit: int) -> List[int]:
+        """Return one page of ranked item ids, ties ordered by series and episode
+
+        Only the first offset + limit entries are kept in a bounded heap, the
+        full match list is never sorted.
+        """
+        sort_keys = self._sort_keys
+        best = heapq.nsmallest(
+            offset + limit,
+            ranks.items(),
+            key=lambda entry: (entry[1], sort_keys[entry[0]], entry[0]),
+        )
+        return [item_id for item_id, _ in best[offset:]]
+
+    def group(self, ranks: Dict[int, int]) -> Dict[int, List[int]]:
+        """Collapse ranked items into the series they belong to"""
+        item_series = self._item_series
+        groups: Dict[int, List[int]] = {}
+        for item_id in ranks:
+            series_id = item_series[item_id]
+            matched = groups.get(series_id)
+            if matched is None:
+                groups[series_id] = [item_id]
+            else:
+                matched.append(item_id)
+        return groups
+
+    def top_series(self, ranks: Dict[int, int], groups: Dict[int, List[int]], offset: int, limit: int) -> List[int]:
+        """Return one page of series ids ordered by their best ranked episode and title"""
+        series_titles = self._series_titles
+        best = heapq.nsmallest(
+            offset + limit,
+            groups.items(),
+            key=lambda entry: (min(ranks[item_id] for item_id in entry[1]), series_titles[entry[0]], entry[0]),
+        )
+        return [series_id for series_id, _ in best[offset:]]
+
+    def series_card(self, series_id: int, matched: List[int]) -> bytes:
+        """Serialize a series card with its newest matching episodes embedded"""
+        showtimes = self._showtimes
+        newest = heapq.nlargest(SERIES_CARD_EPISODES, matched, key=lambda item_id: showtimes[item_id])
+        return b''.join((
+            self._series_payloads[series_id][:-1],
+            b',"matching_episodes":',
+            str(len(matched)).encode(),
+            b',"latest_episodes":[',
+            b','.join(self.payloads[item_id] for item_id in newest),
+            b']}'
+        ))
+
+    def find_series(self, sid: str) -> Optional[int]:
+        return self._series_lookup.get(sid)
+
+    def series_header(self, series_id: int) -> bytes:
+        return self._series_payloads[series_id]
+
+    def series_episodes(self, series_id: int) -> List[int]:
+        """Return all item ids of a series, newest first"""
+        return self._series_items[series_id]
+
+
+class QueryCache:
+    """Bounded LRU cache for search matches.
+
+    Keys include the schedule version so entries from an older schedule can
+    never be served, the cache is also cleared whenever the version changes.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Dict[int, int]]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Dict[int, int]):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
@@ -32,53 +32,24 @@ ls -la /app/data
 echo "=== /app/downloads ==="
 ls -la /app/downloads
 
-# Function to refresh EPG data
-refresh_epg() {
-    echo "Refreshing EPG data..."
-    cd /app/ruvsarpur
-    
-    # Set HOME environment to ensure ruvsarpur writes to the correct location
-    export HOME=/home/appuser
-    echo "HOME is set to: $HOME"
-    
-    python3 ruvsarpur.py --refresh --list
-    if [ $? -eq 0 ]; then
-        # Copy the schedule file to the fallback location
-        cp /home/appuser/.ruvsarpur/tvschedule.json /app/data/.ruvsarpur/ 2>/dev/null || true
-        
-        # Set ownership of created files to match host user
-        if [ -f /home/appuser/.ruvsarpur/tvschedule.json ]; then
-            chown $HOST_UID:$HOST_GID /home/appuser/.ruvsarpur/tvschedule.json 2>/dev/null || true
-        fi
-        if [ -f /app/data/.ruvsarpur/tvschedule.json ]; then
-            chown $HOST_UID:$HOST_GID /app/data/.ruvsarpur/tvschedule.json 2>/dev/null || true
-        fi
-        
-        echo "✅ EPG data refreshed successfully!"
-    else
-        echo "❌ Failed to refresh EPG data"
-        exit 1
-    fi
-}
-
-# Check if EPG data exists and its age
+# The backend refreshes the EPG data in the background when it is missing or more than 2 hours old,
+# series become searchable as they are downloaded so startup does not wait for the refresh. After every
+# refresh it copies the schedule to /app/data/.ruvsarpur and gives it to HOST_UID:HOST_GID.
 if [ -f /home/appuser/.ruvsarpur/tvschedule.json ]; then
-    # Get file age in seconds and convert to hours/minutes
-    file_age_seconds=$(( $(date +%s) - $(stat -c %Y /home/appuser/.ruvsarpur/tvschedule.json) ))
+    # Get the age of the last refresh in seconds and convert to hours/minutes, incremental refreshes
+    # only write the journal and fingerprints next to the schedule so the newest of the files counts
+    refreshed_at=0
+    for file in /home/appuser/.ruvsarpur/tvschedule.json{,.meta,.journal,.fingerprints}; do
+        if [ -f "$file" ] && [ "$(stat -c %Y "$file")" -gt "$refreshed_at" ]; then
+            refreshed_at=$(stat -c %Y "$file")
+        fi
+    done
+    file_age_seconds=$(( $(date +%s) - refreshed_at ))
     file_age_hours=$(( file_age_seconds / 3600 ))
     file_age_minutes=$(( file_age_seconds / 60 ))
     echo "EPG data is ${file_age_hours} hours old (${file_age_minutes} minutes)"
-    
-    # Refresh if older than 2 hours (120 minutes)
-    if [ $file_age_minutes -gt 120 ]; then
-        echo "EPG data is more than 2 hours old (${file_age_minutes} min), refreshing..."
-        refresh_epg
-    else
-        echo "EPG data is recent enough, proceeding with startup..."
-    fi
 else
-    echo "No EPG data found. Downloading initial EPG data..."
-    refresh_epg
+    echo "No EPG data found, the backend downloads it after startup"
 fi
 
 # Set PYTHONPATH
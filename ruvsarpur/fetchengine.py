@@ -0,0 +1,431 @@
+"""
+Pooled, concurrent HTTP fetching for the tv schedule refresh.
+
+A refresh makes a request for every category and every series in the RÚV
+catalog. FetchEngine keeps one requests session with a connection pool sized
+to its concurrency so connections are reused across all of them, and runs
+the requests on a bounded pool of worker threads. Within that bound an
+AdaptiveLimiter per host backs off when the host is overloaded and ramps up
+again when it is healthy, retries wait for it rather than for a backoff of
+their own. Requests for api.ruv.is data can be revalidated against a
+ResponseCache.
+
+Run this module to time a full getVodSchedule() refresh against a local
+stand-in for api.ruv.is at a few concurrency levels, optionally with a cold
+and a warm response cache.
+"""
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ratelimit
+import responsecache
+
+# Number of requests in flight at once unless configured otherwise
+DEFAULT_CONCURRENCY = 10
+
+# Seconds to wait for a server response before the request is retried
+DEFAULT_TIMEOUT = 30
+
+
+class FetchEngine:
+    """
+    A shared HTTP connection pool with an adaptive limit on concurrent requests.
+
+    Args:
+        concurrency (int): Maximum number of requests in flight and of pooled connections per host.
+        retries (int): Retries for connection errors, 429 and 5xx responses.
+        timeout (float): Seconds to wait for a response.
+        cache (responsecache.ResponseCache, optional): Cache for the requests made with cached=True.
+    """
+
+    def __init__(self, concurrency=DEFAULT_CONCURRENCY, retries=5, timeout=DEFAULT_TIMEOUT, cache=None):
+        self.concurrency = max(1, int(concurrency))
+        self.retries = retries
+        self.timeout = timeout
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fetch')
+        self.limiters = {}
+        self.limiters_lock = threading.Lock()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def limiter(self, url):
+        """
+        The limiter shared by all requests to the host of a url.
+
+        Returns:
+            ratelimit.AdaptiveLimiter: The limiter of the host.
+        """
+        host = urllib.parse.urlsplit(url).netloc
+        with self.limiters_lock:
+            if host not in self.limiters:
+                self.limiters[host] = ratelimit.AdaptiveLimiter(host, self.concurrency)
+            return self.limiters[host]
+
+    def get(self, url, cached=False, **kwargs):
+        """
+        GET a url through the shared connection pool.
+
+        Connection errors, 429 and 5xx responses are retried after a backoff
+        and once the limiter of the host lets the request through again.
+
+        Args:
+            url (str): The url to fetch.
+            cached (bool): Revalidate the response against the cache of the engine, if it has one.
+
+        Returns:
+            requests.Response: The response.
+
+        Raises:
+            requests.RequestException: The last connection error, or an HTTPError for the
+            last 429 or 5xx response, once the retries ran out.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        limiter = self.limiter(url)
+        for attempt in range(self.retries + 1):
+            limiter.acquire()
+            start = time.monotonic()
+            status = retry_after = None
+            try:
+                if cached and self.cache is not None:
+                    response = self.cache.get(self.session, url, **kwargs)
+                else:
+                    response = self.session.get(url, **kwargs)
+                status = response.status_code
+                retry_after = _retry_after(response)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                response = None
+            finally:
+                # Also frees the slot of a request that failed with any other error
+                limiter.release(status, time.monotonic() - start, retry_after)
+
+            if response is not None and status not in ratelimit.RETRY_STATUS:
+                return response
+            if attempt == self.retries:
+                response.raise_for_status()
+            time.sleep(limiter.retry_delay(attempt, retry_after))
+
+    def request_counts(self):
+        """
+        Requests made so far and how many of them failed, over every host.
+
+        Returns:
+            tuple: The number of requests and of failed requests.
+        """
+        with self.limiters_lock:
+            limiters = list(self.limiters.values())
+        return sum(limiter.stats['requests'] for limiter in limiters), sum(limiter.stats['errors'] for limiter in limiters)
+
+    def summary(self):
+        """Description of the limits and throttle events of every host for the refresh output"""
+        with self.limiters_lock:
+            return '\n'.join(limiter.summary() for limiter in self.limiters.values())
+
+    def get_all(self, urls, cached=False):
+        """
+        GET several urls concurrently.
+
+        Returns:
+            list: A response, or the exception raised, for each url in order.
+        """
+        futures = [self.executor.submit(self.get, url, cached) for url in urls]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as ex:
+                results.append(ex)
+        return results
+
+    def submit(self, function, *args):
+        """
+        Run a function on a worker thread, for work that makes its own requests through get().
+
+        Returns:
+            concurrent.futures.Future: The pending result.
+        """
+        return self.executor.submit(function, *args)
+
+
+class RefreshProgress:
+    """
+    Counters of a schedule refresh, read from other threads while it runs.
+
+    getVodSchedule() advances them together with its progress bar, the request
+    counters come from the fetch engine the refresh uses.
+    """
+
+    def __init__(self):
+        self.phase = 'starting'
+        self.started = time.monotonic()
+        self.series_started = None
+        self.finished = None
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.engine = None
+
+    def start_series(self, total):
+        """Start counting the series downloads"""
+        self.phase = 'series'
+        self.total = total
+        self.series_started = time.monotonic()
+
+    def advance(self, failed=False):
+        """Count a finished series download"""
+        self.done += 1
+        if failed:
+            self.failed += 1
+
+    def finish(self):
+        """Stop the clock of the refresh, the report stays as it was when it ended"""
+        self.phase = 'done'
+        self.finished = time.monotonic()
+
+    def report(self):
+        """
+        The counters with the request rate and the estimated time left.
+
+        Returns:
+            dict: Phase, series done, total and failed, requests made and failed,
+            requests per second and the estimated seconds left, None until it can be told.
+        """
+        now = self.finished or time.monotonic()
+        elapsed = now - self.started
+        requests_made, request_errors = self.engine.request_counts() if self.engine is not None else (0, 0)
+        eta = None
+        if self.phase == 'series' and self.done > 0:
+            eta = (self.total - self.done) * (now - self.series_started) / self.done
+        return {
+            'phase': self.phase,
+            'series_done': self.done,
+            'series_total': self.total,
+            'series_failed': self.failed,
+            'requests': requests_made,
+            'request_errors': request_errors,
+            'requests_per_second': round(requests_made / elapsed, 1) if elapsed > 0 else 0.0,
+            'elapsed': round(elapsed, 1),
+            'eta': round(eta, 1) if eta is not None else None
+        }
+
+
+def _retry_after(response):
+    """Seconds a Retry-After header asks to wait, None without one"""
+    try:
+        return max(0.0, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return None
+
+
+def _stand_in_catalog(categories, programs, episodes):
+    """Build the category listings and program replies a stand-in server answers with"""
+    listings = {}
+    replies = {}
+    for sid in range(programs):
+        category = 'cat{0}'.format(sid % categories)
+        program = {'id': 100000 + sid, 'title': 'Þáttur {0}'.format(sid), 'web_available_episodes': episodes}
+        listings.setdefault(category, []).append(program)
+        replies[str(program['id'])] = {
+            'id': program['id'],
+            'title': program['title'],
+            'short_description': 'Íslensk þáttaröð.',
+            'description': ['Íslensk þáttaröð um daginn og veginn.'],
+            'image': None,
+            'portrait_image': None,
+            'foreign_title': None,
+            'categories': [{'slug': 'born', 'title': 'Barnaefni'}],
+            'multiple_episodes': episodes > 1,
+            'web_available_episodes': episodes,
+            'episodes': [{
+                'id': program['id'] * 1000 + number,
+                'title': '{0} af {1}'.format(number + 1, episodes),
+                'description': 'Þáttur númer {0} í þáttaröðinni.'.format(number + 1),
+                'image': None,
+                'firstrun': '2024-01-01 20:00:00',
+                'duration': 1800,
+                'duration_friendly': '30 mín',
+                'file': None,
+                'subtitles_url': None,
+                'subtitles': {},
+                'event': number,
+                'rating': 0,
+                'slug': 'thattur',
+                'number': number + 1
+            } for number in range(episodes)]
+        }
+    return listings, replies
+
+
+def serve_stand_in(categories=14, programs=2000, episodes=5, latency=0.02, capacity=None):
+    """
+    Start a local stand-in for the api.ruv.is program endpoints on a background thread.
+
+    Every reply is delayed by latency seconds to stand in for the network round
+    trip. With a capacity, requests beyond that many at once are answered with
+    a 429 like an overloaded server would.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its connections attribute counts accepted
+        connections and its listings and replies attributes hold the catalog it serves.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            super().setup()
+            # Replies are written as headers and body, do not let Nagle hold back the body
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self.server.lock:
+                self.server.connections += 1
+
+        def do_GET(self):
+            with self.server.lock:
+                self.server.active += 1
+                overloaded = capacity is not None and self.server.active > capacity
+                if overloaded:
+                    self.server.rejected += 1
+            try:
+                if overloaded:
+                    time.sleep(latency)
+                    self.send_response(429)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    self.reply()
+            finally:
+                with self.server.lock:
+                    self.server.active -= 1
+
+        def reply(self):
+            base = 'http://{0}:{1}'.format(*self.server.server_address)
+            listings, replies = self.server.listings, self.server.replies
+            parts = self.path.strip('/').split('/')
+            if self.path == '/api/programs/categories/tv':
+                body = {'categories': [{'_self': '{0}/api/programs/category/tv/{1}'.format(base, name)} for name in listings]}
+            elif parts[:4] == ['api', 'programs', 'category', 'tv']:
+                body = {'programs': listings.get(parts[4], [])}
+            elif parts[:3] == ['api', 'programs', 'program'] and parts[3] in replies:
+                body = replies[parts[3]]
+            else:
+                body = None
+            time.sleep(latency)
+            content = json.dumps(body).encode('utf-8')
+            etag = '"{0}"'.format(hashlib.sha1(content).hexdigest())
+            if body is not None and self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200 if body is not None else 404)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.active = 0
+    server.rejected = 0
+    server.listings, server.replies = _stand_in_catalog(categories, programs, episodes)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark(concurrency_levels=(1, 5, 10, 20), cache=False, **catalog):
+    """
+    Time full schedule refreshes against a local stand-in server.
+
+    Args:
+        concurrency_levels (list): Concurrency levels to time.
+        cache (bool): Time every level twice, starting with an empty response cache.
+
+    Returns:
+        dict: Wall time in seconds, episodes read, connections opened, requests
+        rejected as overloaded and the cache and limiter summaries for each run,
+        keyed by concurrency level and run name.
+    """
+    import ruvsarpur
+
+    server = serve_stand_in(**catalog)
+    api_url = ruvsarpur.RUV_API_URL
+    ruvsarpur.RUV_API_URL = 'http://{0}:{1}'.format(*server.server_address)
+    ruvsarpur.printProgress = lambda *args, **kwargs: None
+    results = {}
+    try:
+        for concurrency in concurrency_levels:
+            cache_dir = tempfile.mkdtemp(prefix='ruvsarpur-cache-') if cache else None
+            try:
+                for run in (('cold', 'warm') if cache else ('uncached',)):
+                    response_cache = responsecache.ResponseCache(cache_dir) if cache else None
+                    server.connections = 0
+                    server.rejected = 0
+                    start = time.perf_counter()
+                    with FetchEngine(concurrency, cache=response_cache) as engine:
+                        schedule = ruvsarpur.getVodSchedule({}, False, {}, {}, engine=engine)
+                    results[(concurrency, run)] = {
+                        'seconds': time.perf_counter() - start,
+                        'episodes': len(schedule),
+                        'connections': server.connections,
+                        'rejected': server.rejected,
+                        'cache': response_cache.summary() if cache else None,
+                        'limits': engine.summary()
+                    }
+            finally:
+                if cache_dir is not None:
+                    shutil.rmtree(cache_dir, ignore_errors=True)
+    finally:
+        ruvsarpur.RUV_API_URL = api_url
+        server.shutdown()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time a full schedule refresh against a local stand-in server")
+    parser.add_argument("--programs", help="Number of series in the stand-in catalog", type=int, default=2000)
+    parser.add_argument("--latency", help="Seconds every stand-in reply is delayed by", type=float, default=0.02)
+    parser.add_argument("--concurrency", help="Concurrency levels to time", type=int, nargs='+', default=[1, 5, 10, 20])
+    parser.add_argument("--cache", help="Time a refresh with a cold and a warm response cache", action="store_true")
+    parser.add_argument("--capacity", help="Requests the stand-in serves at once before answering 429", type=int)
+    args = parser.parse_args()
+
+    results = benchmark(args.concurrency, args.cache, programs=args.programs, latency=args.latency, capacity=args.capacity)
+    for (concurrency, run), result in results.items():
+        print("concurrency {0} {1}: {2:.2f}s, {3} episodes, {4} connections, {5} rejected".format(
+            concurrency, run, result['seconds'], result['episodes'], result['connections'], result['rejected']))
+        if result['cache']:
+            print("  cache: " + result['cache'])
+        print("  limits: " + result['limits'])
@@ -0,0 +1,189 @@
+"""
+Adaptive rate and concurrency limiting for requests to a single host.
+
+AdaptiveLimiter combines a token bucket with an AIMD (additive increase,
+multiplicative decrease) concurrency limit shared by every thread making
+requests to the host. Healthy responses raise the limit a little, a 429, a
+5xx, a connection failure or a latency well above the normal one halves it
+for everyone at once. Errors also pause all requests for a moment, or for as
+long as a Retry-After header asks, and cap the request rate to what the
+lowered concurrency limit allows at the normal latency. The cap is raised
+again steadily while responses stay healthy.
+"""
+import collections
+import random
+import threading
+import time
+
+# Responses that tell the server is overloaded and the request can be retried
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Multiplicative decrease on errors and on rising latency
+ERROR_DECREASE = 0.5
+LATENCY_DECREASE = 0.75
+
+# A response this many times slower than the normal latency counts as a latency spike
+LATENCY_FACTOR = 3.0
+# but only if it is also at least this many seconds slower
+LATENCY_MARGIN = 0.1
+
+# Seconds all requests wait after an error without a Retry-After header
+ERROR_PAUSE = 0.25
+
+# Seconds of backoff before the first retry of a request, doubled for every further retry up to the maximum
+RETRY_BACKOFF = 0.25
+RETRY_BACKOFF_MAX = 10.0
+
+# Requests per second the rate limit grows by every second without errors
+RATE_INCREASE = 10.0
+
+# Throttle events kept for the report
+MAX_EVENTS = 20
+
+
+class AdaptiveLimiter:
+    """
+    The concurrency limit and request rate for one host.
+
+    Args:
+        name (str): Name used in the report, usually the host name.
+        max_concurrency (int): Upper bound of the concurrency limit, it starts there.
+        min_concurrency (int): Lower bound of the concurrency limit.
+        min_rate (float): Lowest request rate in requests per second the bucket is cut to.
+        max_rate (float): The token bucket is removed again once its rate grows past this.
+    """
+
+    def __init__(self, name, max_concurrency=10, min_concurrency=1, min_rate=1.0, max_rate=200.0):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.limit = float(self.max_concurrency)
+        # Requests per second, None while the rate is not limited
+        self.rate = None
+        self.tokens = 0.0
+        self.refilled = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None
+        self.baseline = None
+        self.last_decrease = 0.0
+        self.raised = self.refilled
+        # Concurrency limit at the last error, the limit grows slowly from where that error cut it to
+        self.ceiling = None
+        self.condition = threading.Condition()
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0, 'min_limit': self.limit}
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def acquire(self):
+        """Wait until a request may be made"""
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.limit):
+                    wait = 0.5
+                elif self.rate is not None and self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    if self.rate is not None:
+                        self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                self.condition.wait(wait)
+
+    def _decrease(self, now, reason, factor, pause):
+        # One decrease per round trip, the requests already in flight all report the same overload
+        if now - self.last_decrease < max(self.latency or 0.0, 0.5):
+            return
+        self.last_decrease = now
+        if pause:
+            self.ceiling = self.limit
+        self.limit = max(float(self.min_concurrency), self.limit * factor)
+        if pause:
+            # The rate the lowered concurrency limit allows at the normal latency, it spreads out the requests released after the pause
+            rate = self.limit / self.baseline if self.baseline else self.limit
+            self.rate = min(self.max_rate, max(self.min_rate, rate))
+            self.tokens = 0.0
+            self.paused_until = max(self.paused_until, now + pause)
+        self.stats['throttled'] += 1
+        self.stats['min_limit'] = min(self.stats['min_limit'], self.limit)
+        self.events.append((time.time(), reason, self.limit, self.rate))
+
+    def release(self, status, latency, retry_after=None):
+        """
+        Report the outcome of a request made after acquire().
+
+        Args:
+            status (int): Response status code, None if the request failed without a response.
+            latency (float): Seconds the request took.
+            retry_after (float, optional): Seconds the server asked to wait before retrying.
+        """
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.stats['requests'] += 1
+
+            if status is None or status in RETRY_STATUS:
+                self.stats['errors'] += 1
+                reason = 'connection error' if status is None else 'HTTP {0}'.format(status)
+                self._decrease(now, reason, ERROR_DECREASE, retry_after if retry_after is not None else ERROR_PAUSE)
+            else:
+                self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+                # The normal latency follows the lowest average seen, drifting up slowly if the server got slower for good
+                self.baseline = self.latency if self.baseline is None else min(self.latency, self.baseline + (self.latency - self.baseline) * 0.01)
+                if latency > self.baseline * LATENCY_FACTOR and latency > self.baseline + LATENCY_MARGIN:
+                    self._decrease(now, 'latency {0:.2f}s'.format(latency), LATENCY_DECREASE, 0)
+                else:
+                    # Additive increase, about one more request in flight per round of requests, or per ten
+                    # rounds once the limit is back where the last error left it
+                    increase = 1.0 / self.limit
+                    if self.ceiling is not None and self.limit >= self.ceiling * ERROR_DECREASE:
+                        increase /= 10
+                    self.limit = min(float(self.max_concurrency), self.limit + increase)
+                    if self.rate is not None and now > self.paused_until:
+                        self.rate += RATE_INCREASE * (now - max(self.last_decrease, self.raised))
+                        if self.rate > self.max_rate:
+                            self.rate = None
+                    self.raised = now
+            self.condition.notify_all()
+
+    def retry_delay(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retrying a request that failed.
+
+        The delay is an exponential backoff with full jitter, so requests that
+        failed together do not all retry together, and it lasts at least as
+        long as the server asked for and as the pause of all requests.
+
+        Args:
+            attempt (int): Number of the attempt that failed, starting from 0.
+            retry_after (float, optional): Seconds the server asked to wait before retrying.
+
+        Returns:
+            float: The delay in seconds.
+        """
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+        with self.condition:
+            paused = self.paused_until - time.monotonic()
+        return max(delay, retry_after or 0.0, paused)
+
+    def summary(self):
+        """Description of the current limits and the throttle events for the refresh output"""
+        stats = self.stats
+        lines = ["{0}: {1} requests, {2} errors, concurrency limit {3:.1f} of {4} (lowest {5:.1f}), rate {6}, {7} throttle events".format(
+            self.name, stats['requests'], stats['errors'], self.limit, self.max_concurrency, stats['min_limit'],
+            'unlimited' if self.rate is None else '{0:.1f} req/s'.format(self.rate), stats['throttled'])]
+        for at, reason, limit, rate in self.events:
+            lines.append("  {0} {1}, limit {2:.1f}{3}".format(
+                time.strftime('%H:%M:%S', time.localtime(at)), reason, limit,
+                '' if rate is None else ', {0:.1f} req/s'.format(rate)))
+        return '\n'.join(lines)
@@ -0,0 +1,186 @@
+"""
+On-disk cache of HTTP responses revalidated with conditional requests.
+
+Every schedule refresh asks api.ruv.is for the full program data of every
+series, although most of them have not changed since the previous refresh.
+ResponseCache keeps the last response for each url with its ETag and
+Last-Modified validators and sends them back as If-None-Match and
+If-Modified-Since, so an unchanged series costs a 304 without a body.
+Responses without validators are remembered by a hash of their content,
+which still tells whether they changed.
+
+Entries are files named after a hash of the url in the cache directory. The
+least recently used ones are removed once the directory grows past its size
+limit.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Default size limit of the cache directory
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+ENTRY_SUFFIX = '.entry'
+
+# Response headers kept with a cached body
+STORED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def content_hash(body):
+    """Hash identifying a response body"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    A size bounded directory of cached responses.
+
+    Args:
+        directory (str): Location of the cache, it is created if missing.
+        max_bytes (int): Size limit of the cached entries.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'not_modified': 0, 'unchanged': 0, 'changed': 0, 'bytes_saved': 0, 'evicted': 0}
+        os.makedirs(directory, exist_ok=True)
+        # Size of every entry, used for eviction without listing the directory again
+        self.sizes = {}
+        for entry in os.scandir(directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                self.sizes[entry.path] = entry.stat().st_size
+        self.size = sum(self.sizes.values())
+
+    def _entry_path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest() + ENTRY_SUFFIX)
+
+    def _read(self, path):
+        """Read an entry, its header line and the body after it"""
+        try:
+            with open(path, 'rb') as in_file:
+                header = json.loads(in_file.readline())
+                body = in_file.read()
+        except (OSError, ValueError):
+            return None, None
+        # Reading an entry counts as a use for the eviction order
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return header, body
+
+    def _write(self, path, header, body):
+        temporary = '{0}.{1}.{2}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(temporary, 'wb') as out_file:
+            out_file.write(json.dumps(header).encode('utf-8') + b'\n')
+            out_file.write(body)
+        os.replace(temporary, path)
+
+        size = os.path.getsize(path)
+        with self.lock:
+            self.size += size - self.sizes.get(path, 0)
+            self.sizes[path] = size
+        if self.size > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is within its size limit"""
+        entries = []
+        for path in list(self.sizes):
+            try:
+                entries.append((os.stat(path).st_mtime, path))
+            except OSError:
+                entries.append((0, path))
+        entries.sort()
+
+        with self.lock:
+            # Leave some room so every new entry does not trigger another eviction
+            target = self.max_bytes * 0.9
+            for _, path in entries:
+                if self.size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                self.size -= self.sizes.pop(path, 0)
+                self.stats['evicted'] += 1
+
+    def get(self, session, url, **kwargs):
+        """
+        GET a url, revalidating a cached response for it.
+
+        A 304 reply is turned into a 200 response carrying the cached body.
+        Responses get a from_cache attribute telling whether the body came
+        from the cache and an unchanged attribute telling whether it is the
+        same as the previous time the url was fetched.
+
+        Args:
+            session (requests.Session): Session to make the request with.
+            url (str): The url to fetch.
+
+        Returns:
+            requests.Response: The response.
+        """
+        path = self._entry_path(url)
+        header, body = self._read(path)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if header is not None and body is not None and header.get('stored'):
+            if header['headers'].get('ETag'):
+                headers['If-None-Match'] = header['headers']['ETag']
+            if header['headers'].get('Last-Modified'):
+                headers['If-Modified-Since'] = header['headers']['Last-Modified']
+
+        response = session.get(url, headers=headers, **kwargs)
+        with self.lock:
+            self.stats['requests'] += 1
+
+        if response.status_code == 304 and header is not None and header.get('stored'):
+            cached = requests.Response()
+            cached.status_code = 200
+            cached.url = url
+            cached.headers = CaseInsensitiveDict(header['headers'])
+            cached.encoding = response.encoding or 'utf-8'
+            cached._content = body
+            cached.from_cache = True
+            cached.unchanged = True
+            with self.lock:
+                self.stats['not_modified'] += 1
+                self.stats['bytes_saved'] += len(body)
+            return cached
+
+        response.from_cache = False
+        response.unchanged = False
+        if response.status_code != 200:
+            return response
+
+        digest = content_hash(response.content)
+        response.unchanged = header is not None and header.get('hash') == digest
+        with self.lock:
+            self.stats['unchanged' if response.unchanged else 'changed'] += 1
+
+        # Bodies are only worth keeping when the server can tell they did not change
+        stored_headers = {name: response.headers[name] for name in STORED_HEADERS if name in response.headers}
+        stored = 'ETag' in stored_headers or 'Last-Modified' in stored_headers
+        if not response.unchanged or stored != bool(header and header.get('stored')) or stored_headers != (header or {}).get('headers'):
+            try:
+                self._write(path, {'url': url, 'hash': digest, 'stored': stored, 'headers': stored_headers},
+                            response.content if stored else b'')
+            except OSError as ex:
+                print(f"Could not write response cache entry for {url}: {ex}")
+        return response
+
+    def summary(self):
+        """One line description of the cache statistics"""
+        stats = self.stats
+        hit_rate = stats['not_modified'] / stats['requests'] if stats['requests'] else 0
+        return "{0} requests, {1} not modified ({2:.0%} hit rate), {3} unchanged, {4} changed, {5:.1f} MiB not downloaded, {6} evicted, {7:.1f} MiB cached".format(
+            stats['requests'], stats['not_modified'], hit_rate, stats['unchanged'], stats['changed'],
+            stats['bytes_saved'] / 2**20, stats['evicted'], self.size / 2**20)
@@ -60,6 +60,10 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 import utilities
+import schedulestore
+import schedulefile
+import fetchengine
+import responsecache
 
 # Lambdas as shorthands for printing various types of data
 # See https://pypi.python.org/pypi/termcolor for more info
@@ -84,8 +88,14 @@ LOG_DIR="{0}/{1}".format(os.path.expanduser('~'),'.ruvsarpur')
 PREV_LOG_FILE = 'prevrecorded.log'
 # Name of the log file containing the downloaded tv schedule
 TV_SCHEDULE_LOG_FILE = 'tvschedule.json'
+# Name of the SQLite database optionally holding the tv schedule, tvschedule.json is then kept as an export
+TV_SCHEDULE_DB_FILE = 'tvschedule.db'
 # Name of the file containing cache to imdb series and movies matches
 IMDB_CACHE_FILE = 'imdb-cache.json'
+HTTP_CACHE_DIR = 'httpcache'
+
+# An incremental refresh turns into a full one once the last full refresh is this many days old
+FULL_REFRESH_INTERVAL_DAYS = 7
 
 # The available bitrate streams
 QUALITY_BITRATE = {
@@ -108,6 +118,8 @@ RE_VOD_BASE_URL = re.compile(r'(?P<vodbase>.*)\/(?P<rest>.*\.m3u8)', re.IGNORECA
 
 RUV_URL = 'https://ruv-vod.akamaized.net'
 
+RUV_API_URL = 'https://api.ruv.is'
+
 # Function to count lines in very large files efficiently, see: https://stackoverflow.com/a/27517681/779521
 def countLinesInFile(filename):
     with open(filename, 'rb') as f:
@@ -190,7 +202,7 @@ def printProgress (iteration, total, prefix = '', suffix = '', decimals = 1, bar
 #              }
 #            ],
 #}
-def lookupItemInIMDB(item_title, item_year, item_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles):
+def lookupItemInIMDB(item_title, item_year, item_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles, engine=None):
   if item_title is None or len(item_title) < 1:
     return None
 
@@ -210,7 +222,7 @@ def lookupItemInIMDB(item_title, item_year, item_type, sample_duration_sec, tota
     imdb_item_types = ['mini-series', 'tv mini-series'] if total_episode_num > 1 and total_episode_num <= 6 else ['tv series']
   
   try:
-    r = __create_retry_session().get(f"https://v2.sg.media-imdb.com/suggestion/x/{urllib.parse.quote(item_title)}.json?includeVideos=1")
+    r = (engine.get if engine is not None else __create_retry_session().get)(f"https://v2.sg.media-imdb.com/suggestion/x/{urllib.parse.quote(item_title)}.json?includeVideos=1")
     if( r.status_code != 200 ): 
       return None # If the status is not success then terminate
   except:
@@ -658,7 +670,17 @@ def parseArguments():
   parser.add_argument("--imdbfolder", help="Folder storing the downloaded and unzipped title.basics.tsv database snapshot from IMDB, see https://www.imdb.com/interfaces/", 
                                       type=str)
 
-  parser.add_argument("--incremental", help="Performs fast incremental intra-day refreshes. Setting this switch instructs the refresh mechanism to only download information for items that are new since the last full TV schedule refresh from the same day. This option has no effect and a full refresh is performed if the date of this refresh is newer than the latest refresh data. ", action="store_true")
+  parser.add_argument("--sqlite", help="Also keeps the TV schedule in a SQLite database ({0}) with a full text index. Once the database exists it is used for reading the schedule, {1} is still written as an export".format(TV_SCHEDULE_DB_FILE, TV_SCHEDULE_LOG_FILE), action="store_true")
+
+  parser.add_argument("--compress", help="Writes the TV schedule and the IMDB cache gzip compressed, they are still read transparently", action="store_true")
+
+  parser.add_argument("--scheduleformat", help="Layout of the TV schedule file. 1 repeats the series information on every episode, 2 stores it once per series and is smaller and faster to load. Both are read, the default keeps the format of the existing file", type=int, choices=[1, 2])
+
+  parser.add_argument("--fetchconcurrency", help="Maximum number of requests made at once when refreshing the TV schedule, fewer while api.ruv.is is overloaded (default: {0})".format(fetchengine.DEFAULT_CONCURRENCY), type=int, default=fetchengine.DEFAULT_CONCURRENCY)
+
+  parser.add_argument("--httpcachesize", help="Size limit in MiB of the cache of api.ruv.is responses ({0}) that lets a refresh skip downloading unchanged series, 0 disables the cache (default: {1})".format(HTTP_CACHE_DIR, responsecache.DEFAULT_MAX_BYTES // (1024 * 1024)), type=int, default=responsecache.DEFAULT_MAX_BYTES // (1024 * 1024))
+
+  parser.add_argument("--incremental", help="Performs fast incremental refreshes. Setting this switch instructs the refresh mechanism to only download the series whose listing changed since they were last downloaded, series and episodes that are no longer available are removed. A full refresh is performed instead once the last full refresh is more than {0} days old, or from a previous day when the series fingerprints are missing. ".format(FULL_REFRESH_INTERVAL_DAYS), action="store_true")
 
   parser.add_argument("--plex", help="Creates Plex Media Server compatible file names and folder structures. See https://support.plex.tv/articles/naming-and-organizing-your-tv-show-files/", action="store_true")
 
@@ -720,25 +742,25 @@ def getPreviouslyRecordedShows(rec_file_name):
   else:
     return []
 
-def saveCurrentTvSchedule(schedule,tv_file_name):
-  today = datetime.date.today()
+# The date field records the last full refresh, a save that compacts incremental changes passes on the previous one
+def saveCurrentTvSchedule(schedule,tv_file_name,db_file_name=None,compress=False,schedule_format=None,full_refresh_date=None):
+  if full_refresh_date is None:
+    full_refresh_date = datetime.date.today()
 
   # Format the date field
-  schedule['date'] = today.strftime('%Y-%m-%d')
+  schedule['date'] = full_refresh_date.strftime('%Y-%m-%d')
 
   # Make sure that the log directory exists
   try:
     os.makedirs(os.path.dirname(tv_file_name), exist_ok=True)
-    # Try to write the file
-    with open(tv_file_name, 'w+', encoding='utf-8') as out_file:
-      out_file.write(json.dumps(schedule, ensure_ascii=False, sort_keys=True, indent=2*' '))
+    # Try to write the file, it is replaced atomically so readers never see a partial schedule
+    schedulefile.write_schedule(tv_file_name, schedule, compress, schedule_format)
   except PermissionError:
     # If we get a permission error, try the fallback location
     fallback_file = os.path.join('/app/data/.ruvsarpur', os.path.basename(tv_file_name))
     try:
       os.makedirs(os.path.dirname(fallback_file), exist_ok=True)
-      with open(fallback_file, 'w+', encoding='utf-8') as out_file:
-        out_file.write(json.dumps(schedule, ensure_ascii=False, sort_keys=True, indent=2*' '))
+      schedulefile.write_schedule(fallback_file, schedule, compress, schedule_format)
       print(f"Wrote schedule to fallback location: {fallback_file}")
     except Exception as e:
       print(f"Failed to write schedule to fallback location: {e}")
@@ -747,18 +769,43 @@ def saveCurrentTvSchedule(schedule,tv_file_name):
     print(f"Failed to write schedule: {e}")
     raise
 
-def saveImdbCache(imdb_cache, imdb_cache_file_name):
+  # Write the schedule database after the json export, readers only use it while it is at least as new as the export
+  if db_file_name is not None:
+    try:
+      os.makedirs(os.path.dirname(db_file_name), exist_ok=True)
+      with schedulestore.ScheduleStore(db_file_name) as store:
+        store.write_schedule(schedule)
+    except Exception as e:
+      print(f"Failed to write schedule database: {e}")
+
+# Records the series changed by an incremental refresh in the schedule journal instead of rewriting the whole schedule
+# returns False if the full schedule has to be saved instead
+def appendTvScheduleChanges(changes, tv_file_name, db_file_name=None):
+  try:
+    if not schedulefile.append_journal(tv_file_name, changes):
+      return False
+  except Exception as e:
+    print(f"Failed to write schedule journal: {e}")
+    return False
+
+  if db_file_name is not None:
+    try:
+      with schedulestore.ScheduleStore(db_file_name) as store:
+        store.apply_journal(changes)
+    except Exception as e:
+      print(f"Failed to update schedule database: {e}")
+  return True
+
+def saveImdbCache(imdb_cache, imdb_cache_file_name, compress=False):
   os.makedirs(os.path.dirname(imdb_cache_file_name), exist_ok=True)
 
-  with open(imdb_cache_file_name, 'w+', encoding='utf-8') as out_file:
-    out_file.write(json.dumps(imdb_cache, ensure_ascii=False, sort_keys=True, indent=2*' '))
+  schedulefile.write_json(imdb_cache_file_name, imdb_cache, compress)
   
 def getExistingJsonFile(file_name):
   try:
     tv_file = Path(file_name)
     if tv_file.is_file():
-      with tv_file.open('r+',encoding='utf-8') as in_file:
-        existing = json.load(in_file)
+      existing = schedulefile.load_json(tv_file, snapshot=False)
       
       return existing
     else:
@@ -767,13 +814,51 @@ def getExistingJsonFile(file_name):
     print(f"Could not open '{file_name}', {ex})")
     return None
 
-def getExistingTvSchedule(tv_file_name):
+# Reads the tv schedule from the schedule database, optionally only the given programs or series
+def getExistingTvScheduleFromDb(db_file_name, pids=None, sids=None):
+  try:
+    if not Path(db_file_name).is_file():
+      return None
+    with schedulestore.ScheduleStore(db_file_name) as store:
+      existing = store.read_schedule(pids, sids)
+    if existing is None:
+      return None
+
+    # format the date field
+    existing['date'] = datetime.datetime.strptime(existing['date'], '%Y-%m-%d')
+    return existing
+  except Exception as e:
+    print(f"Could not open schedule database: {e}")
+    return None
+
+# The schedule database is only read while it is at least as new as the json export and its journal,
+# a failed database write or a refresh that only wrote the json file leaves it behind
+def isTvScheduleDbCurrent(db_file_name, tv_file_name):
+  try:
+    db_modified = os.stat(db_file_name).st_mtime_ns
+  except OSError:
+    return False
+  for file_name in (tv_file_name, schedulefile.journal_path(tv_file_name)):
+    try:
+      if os.stat(file_name).st_mtime_ns > db_modified:
+        return False
+    except OSError:
+      pass
+  return True
+
+def getExistingTvSchedule(tv_file_name, db_file_name=None, pids=None, sids=None):
+  # Prefer the schedule database, it avoids parsing the whole json file
+  if db_file_name is not None and isTvScheduleDbCurrent(db_file_name, tv_file_name):
+    existing = getExistingTvScheduleFromDb(db_file_name, pids, sids)
+    if existing is not None:
+      return existing
+
   # Try the primary location first
   try:
     tv_file = Path(tv_file_name)
     if tv_file.is_file():
-      with tv_file.open('r+',encoding='utf-8') as in_file:
-        existing = json.load(in_file)
+      # Reads either schedule format and brings in the series changed by incremental refreshes since the file was written
+      existing, _ = schedulefile.load_schedule(tv_file)
       
       # format the date field
       existing['date'] = datetime.datetime.strptime(existing['date'], '%Y-%m-%d')
@@ -786,8 +871,7 @@ def getExistingTvSchedule(tv_file_name):
     try:
       fallback_file = Path('/app/data/.ruvsarpur') / Path(tv_file_name).name
       if fallback_file.is_file():
-        with fallback_file.open('r+',encoding='utf-8') as in_file:
-          existing = json.load(in_file)
+        existing, _ = schedulefile.load_schedule(fallback_file)
         
         # format the date field
         existing['date'] = datetime.datetime.strptime(existing['date'], '%Y-%m-%d')
@@ -935,10 +1019,28 @@ RE_CAPTURE_VOD_EPNUM_FROM_TITLE = re.compile(r'(?P<ep_num>\d+) af (?P<ep_total>\
 #
 # Downloads the full front page VOD schedule and for each episode in there fetches all available episodes
 # uses the new RUV GraphQL queries
-def getVodSchedule(existing_schedule, args_incremental_refresh=False, imdb_cache=None, imdb_orignal_titles=None):
+# all requests go through the connection pool of the fetch engine, which also bounds how many run at once
+# fingerprints maps series ids to the fingerprint of their listing when they were last downloaded, it is updated in place
+# and lets an incremental refresh skip the series whose listing did not change
+# progress is a fetchengine.RefreshProgress that is advanced together with the progress bar, for reporting it elsewhere
+# on_series is called with the sid and the episodes of every series as soon as it has been downloaded
+def getVodSchedule(existing_schedule, args_incremental_refresh=False, imdb_cache=None, imdb_orignal_titles=None, changes=None, engine=None, fingerprints=None, progress=None, on_series=None):
+  # Without an engine of its own the refresh gets a default one for its duration
+  if engine is None:
+    with fetchengine.FetchEngine() as engine:
+      return getVodSchedule(existing_schedule, args_incremental_refresh, imdb_cache, imdb_orignal_titles, changes, engine, fingerprints, progress, on_series)
+
+  if progress is not None:
+    progress.phase = 'categories'
+    progress.engine = engine
+
   # Fetch all categories to get the full program catalog (~2000+ programs across 14 categories)
-  ruv_api_url_categories = 'https://api.ruv.is/api/programs/categories/tv'
-  r_cat = __create_retry_session().get(ruv_api_url_categories)
+  ruv_api_url_categories = RUV_API_URL + '/api/programs/categories/tv'
+  try:
+    r_cat = engine.get(ruv_api_url_categories, cached=True)
+  except requests.RequestException as ex:
+    print(color_warn(f"Unable to retrieve the VOD categories, {ex}"))
+    r_cat = None
 
   schedule = {}
 
@@ -946,18 +1048,19 @@ def getVodSchedule(existing_schedule, args_incremental_refresh=False, imdb_cache
   if args_incremental_refresh:
     schedule = existing_schedule
 
-  if r_cat.status_code != 200:
+  if r_cat is None or r_cat.status_code != 200:
     return schedule
 
   categories = r_cat.json().get('categories', [])
 
   data = []
-  for category in categories:
-    cat_url = category.get('_self')
-    if not cat_url:
-      continue
-    r = __create_retry_session().get(cat_url)
-    if r.status_code != 200:
+  # Series can only be considered removed if every category was read
+  all_categories_read = True
+  # The categories are read in parallel
+  cat_urls = [category.get('_self') for category in categories if category.get('_self')]
+  for r in engine.get_all(cat_urls, cached=True):
+    if isinstance(r, Exception) or r.status_code != 200:
+      all_categories_read = False
       continue
     cat_data = r.json()
     if 'programs' in cat_data:
@@ -975,18 +1078,49 @@ def getVodSchedule(existing_schedule, args_incremental_refresh=False, imdb_cache
   # Filter out all programs that do not have any vod files to download and have an id field
   panels = [p for p in data if 'web_available_episodes' in p and 'id' in p and p['web_available_episodes'] > 0]
 
+  # Fingerprints of the series as they are listed now, recorded once a series has been downloaded
+  listed_fingerprints = {str(program['id']): schedulefile.program_fingerprint(program) for program in panels}
+
+  # The existing episodes of every series, grouped once instead of scanning the schedule for every program
+  existing_series = {}
+
   # If doing incremental update, filter out programs that haven't changed
   if args_incremental_refresh:
+    # Drop the series that are no longer available
+    if all_categories_read:
+      removed_sids = {schedule[p]['sid'] for p in schedule if type(schedule[p]) is dict and schedule[p]['sid'] not in listed_fingerprints}
+      # Applied together, every application scans the whole schedule
+      removals = [schedulefile.delete_record(sid) for sid in removed_sids]
+      schedulefile.apply_journal(schedule, removals)
+      if changes is not None:
+        changes.extend(removals)
+      if removed_sids:
+        print(f"Removed {len(removed_sids)} series that are no longer available")
+      if fingerprints is not None:
+        for sid in set(fingerprints) - set(listed_fingerprints):
+          del fingerprints[sid]
+
+    for pid, item in schedule.items():
+      if type(item) is dict:
+        existing_series.setdefault(item['sid'], {})[pid] = item
+
     filtered_panels = []
     for program in panels:
-      existing_vod_episodes_count = sum(type(schedule[p]) is dict and schedule[p]['sid'] == str(program['id']) for p in schedule)
-      if program['web_available_episodes'] > existing_vod_episodes_count:
+      sid = str(program['id'])
+      existing_vod_episodes_count = len(existing_series.get(sid, {}))
+      if fingerprints is not None:
+        # Any change to the listing, including episodes that expired, downloads the whole series again
+        if existing_vod_episodes_count == 0 or fingerprints.get(sid) != listed_fingerprints[sid]:
+          filtered_panels.append(program)
+      elif program['web_available_episodes'] > existing_vod_episodes_count:
         filtered_panels.append(program)
         print(f"Detected {program['web_available_episodes'] - existing_vod_episodes_count} new entries for {color_sid(program['title'])}")
     panels = filtered_panels
 
   completed_programs = 0
   total_programs = len(panels)
+  if progress is not None:
+    progress.start_series(total_programs)
   
   if total_programs == 0:
     print("No new content found in incremental update")
@@ -995,28 +1129,47 @@ def getVodSchedule(existing_schedule, args_incremental_refresh=False, imdb_cache
   print("{0} | Total: {1} series to update".format(color_title('Downloading VOD schedule'), total_programs))
   printProgress(completed_programs, total_programs, prefix = 'Reading:', suffix = '', barLength = 25)
 
-  # Use ThreadPoolExecutor to parallelize the API calls
-  with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-    # Create a list to store the future objects
-    future_to_program = {
-      executor.submit(getVodSeriesSchedule, program['id'], program, imdb_cache, imdb_orignal_titles): program 
-      for program in panels
-    }
-
-    # Process the results as they complete
-    for future in concurrent.futures.as_completed(future_to_program):
-      program = future_to_program[future]
-      completed_programs += 1
-      
-      try:
-        program_schedule = future.result()
-        if program_schedule:
-          schedule.update(program_schedule)
-      except Exception as ex:
-        print(f"Unable to retrieve schedule for VOD program '{program['title']}', no episodes will be available for download from this program.")
-        print(traceback.format_exc())
-      
-      printProgress(completed_programs, total_programs, prefix = 'Reading:', suffix ='', barLength = 25)
+  # The changed series are applied to the schedule together once all are downloaded
+  upserts = []
+
+  # Parallelize the API calls on the workers of the fetch engine
+  # Create a list to store the future objects
+  future_to_program = {
+    engine.submit(getVodSeriesSchedule, program['id'], program, imdb_cache, imdb_orignal_titles, engine): program 
+    for program in panels
+  }
+
+  # Process the results as they complete
+  for future in concurrent.futures.as_completed(future_to_program):
+    program = future_to_program[future]
+    completed_programs += 1
+    failed = False
+    
+    try:
+      program_schedule = future.result()
+      sid = str(program['id'])
+      if program_schedule and args_incremental_refresh:
+        # Replace all episodes of the series so episodes that went away are dropped too, unless nothing changed
+        if program_schedule != existing_series.get(sid):
+          upserts.append(schedulefile.upsert_record(program['id'], program_schedule))
+      elif program_schedule:
+        schedule.update(program_schedule)
+      if program_schedule and fingerprints is not None:
+        fingerprints[sid] = listed_fingerprints[sid]
+      if program_schedule and on_series is not None:
+        on_series(sid, program_schedule)
+    except Exception as ex:
+      print(f"Unable to retrieve schedule for VOD program '{program['title']}', no episodes will be available for download from this program.")
+      print(traceback.format_exc())
+      failed = True
+    
+    printProgress(completed_programs, total_programs, prefix = 'Reading:', suffix ='', barLength = 25)
+    if progress is not None:
+      progress.advance(failed)
+
+  schedulefile.apply_journal(schedule, upserts)
+  if changes is not None:
+    changes.extend(upserts)
 
   return schedule
 
@@ -1058,13 +1211,13 @@ def formatCoverArtResolutionMacro(rawsrc):
 
 #
 # Given a series id and program data, downloads all episodes available for that series
-def getVodSeriesSchedule(sid, _, imdb_cache, imdb_orignal_titles):
+def getVodSeriesSchedule(sid, _, imdb_cache, imdb_orignal_titles, engine=None):
   schedule = {}  
 
   # Perform two lookups, first to the API as this gives us a more complete information about the series, but unfortunately no episode data
-  ruv_api_url_sid = 'https://api.ruv.is/api/programs/program/{0}/all'.format(sid)
+  ruv_api_url_sid = RUV_API_URL + '/api/programs/program/{0}/all'.format(sid)
 
-  r = __create_retry_session().get(ruv_api_url_sid)  
+  r = engine.get(ruv_api_url_sid, cached=True) if engine is not None else __create_retry_session().get(ruv_api_url_sid)
   prog = r.json()  
   if r.status_code != 200 or prog is None or not 'episodes' in prog or len(prog['episodes']) < 1:
     return schedule
@@ -1127,13 +1280,13 @@ def getVodSeriesSchedule(sid, _, imdb_cache, imdb_orignal_titles):
     imdb_result = None
     # first check the foreign title, this is most likely to result in a match
     if imdb_result is None and not foreign_title is None:
-      imdb_result = lookupItemInIMDB(foreign_title, series_year, series_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles)
+      imdb_result = lookupItemInIMDB(foreign_title, series_year, series_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles, engine)
 
     # Icheck the local title AND ONLY IF THIS IS A MOVIE.
     # this condition will be mostly true for icelandic movies and documentaries, this is also true when RUV incorrectly enters their data
     #  and places the english name in the series and the icelandic name in the foreign title!, which is very common.
     if imdb_result is None and not series_title is None and isMovie:
-      imdb_result = lookupItemInIMDB(series_title, series_year, series_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles)
+      imdb_result = lookupItemInIMDB(series_title, series_year, series_type, sample_duration_sec, total_episode_num, isIcelandic, imdb_orignal_titles, engine)
 
     # If the imdb result was found then store it in the corrections file for later reuse
     if not imdb_result is None:
@@ -1357,13 +1510,119 @@ def loadImdbOriginalTitles(args_imdbfolder):
   print()
 
   return imdb_title_cache
+
+# Downloads a fresh tv schedule and saves it, usable as a library function without going through the command line
+# schedule is the existing schedule, it is only kept for an incremental refresh from the same day,
+# with load_existing it is read from the schedule files once the refresh lock is held instead
+# returns the new schedule dictionary, the same content that was written to tv_schedule_file_name
+# http_cache_dir keeps the api responses so unchanged series are only revalidated on the next refresh
+# progress is a fetchengine.RefreshProgress for following the refresh from another thread
+# on_series is called with the sid and the episodes of every series as soon as it has been downloaded
+# Only one refresh of a schedule file runs at a time, when another one is running, in this or another process,
+# it is waited for and the schedule it saved is returned instead of downloading everything again, unless forced
+def refreshTvSchedule(schedule, tv_schedule_file_name, tv_schedule_db_file_name=None, imdb_cache_file_name=None, incremental=False, force=False, imdbfolder=None, compress=False, schedule_format=None, fetch_concurrency=fetchengine.DEFAULT_CONCURRENCY, http_cache_dir=None, http_cache_size=responsecache.DEFAULT_MAX_BYTES, progress=None, on_series=None, load_existing=False):
+  # The state of the schedule files when the other refresh was found running
+  files_before_wait = []
+
+  def waitForRefresh():
+    files_before_wait.append(getTvScheduleFilesState(tv_schedule_file_name, tv_schedule_db_file_name))
+    print(color_warn("Another refresh of the TV schedule is running, waiting for it to finish"))
+    if progress is not None:
+      progress.phase = 'waiting'
+
+  with schedulefile.refresh_lock(tv_schedule_file_name, waitForRefresh) as waited:
+    # Unless the other refresh failed to save anything its schedule is as fresh as this one would be
+    if waited and not force and getTvScheduleFilesState(tv_schedule_file_name, tv_schedule_db_file_name) != files_before_wait[0]:
+      refreshed = getExistingTvSchedule(tv_schedule_file_name, tv_schedule_db_file_name)
+      if refreshed is not None:
+        print("Using the TV schedule saved by the other refresh")
+        return refreshed
+    # Under the lock no other refresh can be replacing the files while they are read
+    if load_existing:
+      schedule = getExistingTvSchedule(tv_schedule_file_name, tv_schedule_db_file_name)
+    return __refreshTvSchedule(schedule, tv_schedule_file_name, tv_schedule_db_file_name, imdb_cache_file_name, incremental, force, imdbfolder,
+                               compress, schedule_format, fetch_concurrency, http_cache_dir, http_cache_size, progress, on_series)
+
+# Modification time and size of the schedule file, its journal and the schedule database, they change with every saved refresh
+def getTvScheduleFilesState(tv_schedule_file_name, tv_schedule_db_file_name=None):
+  state = []
+  for file_name in (tv_schedule_file_name, schedulefile.journal_path(tv_schedule_file_name), tv_schedule_db_file_name):
+    try:
+      stat = os.stat(file_name)
+      state.append((stat.st_mtime_ns, stat.st_size))
+    except (OSError, TypeError):
+      state.append(None)
+  return state
+
+def __refreshTvSchedule(schedule, tv_schedule_file_name, tv_schedule_db_file_name, imdb_cache_file_name, incremental, force, imdbfolder, compress, schedule_format, fetch_concurrency, http_cache_dir, http_cache_size, progress, on_series):
+  today = datetime.date.today()
+
+  # Only load the IMDB data if we are refreshing the schedule
+  imdb_orignal_titles = loadImdbOriginalTitles(imdbfolder)
+  imdb_cache = getExistingJsonFile(imdb_cache_file_name) if imdb_cache_file_name is not None else None
+  if( imdb_cache is None ):
+    imdb_cache = {}
+
+  # The series fingerprints recorded by the previous refresh of this schedule file
+  fingerprints = schedulefile.read_fingerprints(tv_schedule_file_name)
+
+  # Only clear out the schedule if we are not dealing with an incremental update, if the last full refresh is too old
+  # or if the dates don't match anymore and there are no fingerprints to tell which series changed
+  last_full_refresh = None
+  if schedule is not None:
+    last_full_refresh = schedule['date'].date()
+    if last_full_refresh < today - datetime.timedelta(days=FULL_REFRESH_INTERVAL_DAYS) or (fingerprints is None and last_full_refresh < today):
+      schedule = None
+  if schedule is None or not incremental or force:
+    schedule = {}
+  
+  # Downloading the full VOD available schedule as well, signal an incremental update if the schedule object has entries in it
+  incremental_refresh = len(schedule) > 0
+  if fingerprints is None or not incremental_refresh:
+    fingerprints = {}
+  changes = []
+  http_cache = None
+  if http_cache_dir is not None and http_cache_size > 0:
+    try:
+      http_cache = responsecache.ResponseCache(http_cache_dir, http_cache_size)
+    except OSError as ex:
+      print(color_warn(f"Could not open the response cache in {http_cache_dir}, {ex}"))
+
+  with fetchengine.FetchEngine(fetch_concurrency, cache=http_cache) as engine:
+    schedule = getVodSchedule(schedule, incremental_refresh, imdb_cache, imdb_orignal_titles, changes, engine, fingerprints, progress, on_series) 
+    print("{0} | {1}".format(color_title('Rate limits'), engine.summary()))
+
+  if http_cache is not None:
+    print("{0} | {1}".format(color_title('Response cache'), http_cache.summary()))
+
+  if progress is not None:
+    progress.phase = 'saving'
+
+  # An incremental refresh only journals the changed series, the journal is compacted into a full save once it grows too large
+  if incremental_refresh and (len(changes) == 0 or appendTvScheduleChanges(changes, tv_schedule_file_name, tv_schedule_db_file_name)):
+    if len(changes) > 0:
+      print(f"Journaled changes to {len(changes)} series")
+  # Save the tv schedule as the most current one, save it to ensure we format the today date,
+  # compacting the journal of an incremental refresh keeps the date of the last full refresh
+  elif len(schedule) > 1 :
+    saveCurrentTvSchedule(schedule, tv_schedule_file_name, tv_schedule_db_file_name, compress, schedule_format,
+                          last_full_refresh if incremental_refresh else None)
+
+  # Recorded against the schedule file version just written or journaled
+  try:
+    schedulefile.write_fingerprints(tv_schedule_file_name, fingerprints)
+  except OSError as ex:
+    print(color_warn(f"Could not save the series fingerprints, the next refresh downloads every series, {ex}"))
+
+  if len(imdb_cache) > 0 and imdb_cache_file_name is not None:
+    saveImdbCache(imdb_cache, imdb_cache_file_name, compress)
+
+  return schedule
     
 # The main entry point for the script
 def runMain():
   try:
     init() # Initialize the colorama library
-    
-    today = datetime.date.today()
 
     # Get the current working directory (place that the script is executing from)
     working_dir = sys.path[0]
@@ -1377,36 +1636,27 @@ def runMain():
     # Create the full filenames for the config files
     previously_recorded_file_name = createFullConfigFileName(args.portable,PREV_LOG_FILE)
     tv_schedule_file_name = createFullConfigFileName(args.portable,TV_SCHEDULE_LOG_FILE)
+    tv_schedule_db_file_name = createFullConfigFileName(args.portable,TV_SCHEDULE_DB_FILE)
+    if not args.sqlite and not os.path.isfile(tv_schedule_db_file_name):
+      tv_schedule_db_file_name = None
     
     # Get information about already downloaded episodes
     previously_recorded = getPreviouslyRecordedShows(previously_recorded_file_name)
 
     # Get an existing tv schedule if possible
-    schedule = getExistingTvSchedule(tv_schedule_file_name)
+    # When only specific programs or series are requested from the database there is no need to read the rest of it,
+    # --find reads every episode, the fuzzy title matching below can match titles a text search would not
+    if args.refresh:
+      schedule = getExistingTvSchedule(tv_schedule_file_name, tv_schedule_db_file_name)
+    else:
+      schedule = getExistingTvSchedule(tv_schedule_file_name, tv_schedule_db_file_name, args.pid, args.sid)
     
     if( args.refresh or schedule is None  ):
-    
-      # Only load the IMDB data if we are refreshing the schedule
-      imdb_orignal_titles = loadImdbOriginalTitles(args.imdbfolder)
       imdb_cache_file_name = createFullConfigFileName(args.portable, IMDB_CACHE_FILE)
-      imdb_cache = getExistingJsonFile(imdb_cache_file_name)
-      if( imdb_cache is None ):
-        imdb_cache = {}
-
-      # Only clear out the schedule if we are not dealing with an incremental update
-      # or if the dates don't match anymore 
-      if not args.incremental or schedule['date'].date() < today or args.force:
-        schedule = {}
-      
-      # Downloading the full VOD available schedule as well, signal an incremental update if the schedule object has entries in it
-      schedule = getVodSchedule(schedule, len(schedule) > 0, imdb_cache, imdb_orignal_titles) 
-    
-      # Save the tv schedule as the most current one, save it to ensure we format the today date
-      if len(schedule) > 1 :
-        saveCurrentTvSchedule(schedule, tv_schedule_file_name)
-
-      if len(imdb_cache) > 0:
-        saveImdbCache(imdb_cache, imdb_cache_file_name)
+      http_cache_dir = createFullConfigFileName(args.portable, HTTP_CACHE_DIR)
+      schedule = refreshTvSchedule(schedule, tv_schedule_file_name, tv_schedule_db_file_name, imdb_cache_file_name,
+                                   args.incremental, args.force, args.imdbfolder, args.compress, args.scheduleformat, args.fetchconcurrency,
+                                   http_cache_dir, args.httpcachesize * 1024 * 1024)
 
     if( args.debug ):
       for key, schedule_item in schedule.items():
@@ -1493,7 +1743,7 @@ def runMain():
       # First download the URL for the listing if needed
       if not 'file' in item or item['file'] is None or len(item['file']) < 1 or not str(item['file']).startswith(RUV_URL):
         # Use the REST API to look up the episode file URL (replaces broken GraphQL persisted query)
-        ep_rest_url = 'https://api.ruv.is/api/programs/program/{0}/all'.format(item['sid'])
+        ep_rest_url = RUV_API_URL + '/api/programs/program/{0}/all'.format(item['sid'])
         ep_rest_r = __create_retry_session().get(ep_rest_url)
         ep_data = None
         if ep_rest_r.status_code == 200:
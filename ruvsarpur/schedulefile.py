@@ -0,0 +1,714 @@
+"""
+Reading and writing of the tv schedule json file.
+
+Parsing tvschedule.json is the slowest part of starting the backend or a
+ruvsarpur.py run. A binary snapshot of the parsed schedule is kept next to
+the json file and loaded instead whenever it was written from the json file
+as it is now, identified by its modification time and size.
+
+The json files are written compact, optionally gzip compressed, to a
+temporary file that is synced and renamed over the old one so readers never
+see a partly written file. A small sidecar file records the write so its
+freshness can be checked without parsing the json.
+
+Incremental refreshes append per series changes to a journal next to the
+json file instead of rewriting it. Readers apply the journal records written
+on top of the json file version they loaded, a full write compacts the
+journal away. A fingerprint of every series as the program listing
+described it when it was last downloaded is kept next to the journal, so the
+next incremental refresh only downloads the series whose listing changed.
+
+Only one refresh of a schedule file runs at a time, across processes, held
+off by an advisory lock on a file next to it. Where fcntl is not available
+refreshes are not coordinated.
+
+Schedules are written in one of two layouts. Format 1 is the original
+dictionary of episodes keyed by pid, every episode repeating the fields of
+its series. Format 2 stores the series fields once per sid and only keeps
+the fields that differ from them on the episodes. load_schedule() reads both
+and always returns the format 1 dictionary.
+
+Run this module with a schedule file path to compare the cold load times of
+the formats, or with --migrate to rewrite a schedule in another format.
+"""
+import argparse
+import contextlib
+import gc
+import gzip
+import hashlib
+import io
+import json
+import marshal
+import os
+import shutil
+import sys
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+# Appended to the json file name to get the snapshot, sidecar, journal, fingerprint and lock file names
+SNAPSHOT_SUFFIX = '.snapshot'
+META_SUFFIX = '.meta'
+JOURNAL_SUFFIX = '.journal'
+FINGERPRINTS_SUFFIX = '.fingerprints'
+LOCK_SUFFIX = '.lock'
+SNAPSHOT_MAGIC = 'ruvsarpur-schedule-snapshot'
+# marshal data is only readable by the Python version that wrote it
+SNAPSHOT_VERSION = '1-{0}-{1}.{2}'.format(marshal.version, *sys.version_info[:2])
+
+# Version of the json file layout recorded in the sidecar
+FORMAT_VERSION = 1
+SCHEDULE_FORMAT_V2 = 2
+
+# Schedule fields that ruvsarpur.py fills in from the series, format 2 stores them once per series
+SERIES_FIELDS = (
+    'series_title', 'series_desc', 'series_sdesc', 'series_image', 'portrait_image', 'original-title',
+    'categories', 'is_movie', 'is_sport', 'is_docu', 'english_subtitled', 'multiple_episodes',
+    'web_available_episodes', 'imdb'
+)
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_LEVEL = 6
+
+# Once the journal is larger than this the next refresh rewrites the json file instead
+JOURNAL_MAX_BYTES = 4 * 1024 * 1024
+
+
+def snapshot_path(file_name):
+    return str(file_name) + SNAPSHOT_SUFFIX
+
+
+def meta_path(file_name):
+    return str(file_name) + META_SUFFIX
+
+
+def journal_path(file_name):
+    return str(file_name) + JOURNAL_SUFFIX
+
+
+def fingerprints_path(file_name):
+    return str(file_name) + FINGERPRINTS_SUFFIX
+
+
+def lock_path(file_name):
+    return str(file_name) + LOCK_SUFFIX
+
+
+def _snapshot_header(file_name):
+    """The first line of a snapshot, identifying the json file it was written from"""
+    stat = os.stat(file_name)
+    header = [SNAPSHOT_MAGIC, SNAPSHOT_VERSION, stat.st_mtime_ns, stat.st_size]
+    return (json.dumps(header) + '\n').encode('ascii')
+
+
+def _load_without_gc(load, data):
+    # The loaded schedule holds no reference cycles, collecting while it is built only costs time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return load(data)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_snapshot(file_name):
+    """
+    Load the snapshot of a json file if it is fresh.
+
+    Args:
+        file_name (str): Path of the json file.
+
+    Returns:
+        The parsed json content, or None if there is no fresh snapshot.
+    """
+    try:
+        with open(snapshot_path(file_name), 'rb') as snapshot:
+            if snapshot.readline() != _snapshot_header(file_name):
+                return None
+            # marshal.load() reads a file in small pieces, loading from bytes is much faster
+            data = snapshot.read()
+        return _load_without_gc(marshal.loads, data)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_snapshot(file_name, content, header=None):
+    """
+    Write the snapshot of a json file that holds the given content.
+
+    Failing to write the snapshot is not an error, the json file is still there.
+
+    Returns:
+        bool: True if the snapshot was written.
+    """
+    target = snapshot_path(file_name)
+    temporary = '{0}.{1}.tmp'.format(target, os.getpid())
+    try:
+        with open(temporary, 'wb') as snapshot:
+            snapshot.write(header or _snapshot_header(file_name))
+            marshal.dump(content, snapshot)
+        os.replace(temporary, target)
+        return True
+    except (OSError, ValueError):
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        return False
+
+
+def _open_text(file_name):
+    """Open a json file for reading, gzip compressed files are recognised by their header"""
+    with open(file_name, 'rb') as raw:
+        compressed = raw.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(file_name, 'rt', encoding='utf-8')
+    return open(file_name, 'r', encoding='utf-8')
+
+
+def load_json(file_name, snapshot=True):
+    """
+    Load a json file, plain or gzip compressed.
+
+    With snapshot set the file is loaded through its snapshot, which is
+    refreshed when it is stale.
+
+    Args:
+        file_name (str): Path of the json file.
+        snapshot (bool): Use and maintain the binary snapshot of the file.
+
+    Returns:
+        The parsed json content.
+    """
+    content = read_snapshot(file_name) if snapshot else None
+    if content is None:
+        # Identify the file before reading it, a concurrent rewrite then leaves the snapshot stale
+        header = _snapshot_header(file_name) if snapshot else None
+        with _open_text(file_name) as in_file:
+            content = _load_without_gc(json.load, in_file)
+        if snapshot:
+            write_snapshot(file_name, content, header)
+    return content
+
+
+def read_meta(file_name):
+    """
+    Read the sidecar written along with a json file.
+
+    Returns:
+        dict: The format version, write version, item count, size and write
+        time of the json file, or None if there is no sidecar.
+    """
+    try:
+        with open(meta_path(file_name), 'r', encoding='utf-8') as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_chunks(out_file, content):
+    """Write compact json, a dictionary is written one entry at a time"""
+    if not isinstance(content, dict):
+        out_file.write(json.dumps(content, ensure_ascii=False, separators=(',', ':')))
+        return
+    # json.dump() would stream too but it never uses the C encoder, dumping entry by entry does
+    out_file.write('{')
+    first = True
+    for key, value in content.items():
+        if not first:
+            out_file.write(',')
+        first = False
+        out_file.write(json.dumps(str(key), ensure_ascii=False))
+        out_file.write(':')
+        out_file.write(json.dumps(value, ensure_ascii=False, separators=(',', ':')))
+    out_file.write('}')
+
+
+def _fsync_directory(directory):
+    # Makes the rename itself durable, not supported on every platform
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+def _replace_file(file_name, write):
+    """Write a file through a synced temporary file renamed over the original"""
+    file_name = os.path.abspath(str(file_name))
+    temporary = '{0}.{1}.tmp'.format(file_name, os.getpid())
+    try:
+        with open(temporary, 'wb') as raw:
+            write(raw)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temporary, file_name)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(os.path.dirname(file_name))
+
+
+def write_json(file_name, content, compress=False, items=None, layout=FORMAT_VERSION):
+    """
+    Atomically write a json file and its sidecar.
+
+    Args:
+        file_name (str): Path of the json file.
+        content: The json content.
+        compress (bool): Gzip compress the file, readers in this module detect it.
+        items (int, optional): Item count recorded in the sidecar, defaults to len(content).
+        layout (int): Format version of the content recorded in the sidecar.
+
+    Returns:
+        dict: The sidecar content.
+    """
+    def write(raw):
+        if compress:
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=GZIP_LEVEL) as compressed:
+                with io.TextIOWrapper(compressed, encoding='utf-8') as out_file:
+                    _write_chunks(out_file, content)
+        else:
+            out_file = io.TextIOWrapper(raw, encoding='utf-8')
+            _write_chunks(out_file, content)
+            # Hand the file back to the caller open, it still has to be synced
+            out_file.detach()
+
+    _replace_file(file_name, write)
+
+    previous = read_meta(file_name) or {}
+    meta = {
+        'format': layout,
+        'version': previous.get('version', 0) + 1,
+        'items': len(content) if items is None else items,
+        'size': os.path.getsize(file_name),
+        'compressed': compress,
+        'written_at': time.time()
+    }
+    _replace_file(meta_path(file_name), lambda raw: raw.write(json.dumps(meta).encode('utf-8')))
+    return meta
+
+
+def is_normalized(content):
+    """Check whether parsed schedule content is in format 2"""
+    return isinstance(content, dict) and content.get('format') == SCHEDULE_FORMAT_V2 and 'episodes' in content
+
+
+def normalize_schedule(schedule):
+    """
+    Convert a format 1 schedule into format 2.
+
+    The series record holds the series fields that every episode of the
+    series has, with the values of the first episode seen. An episode keeps
+    the series fields the record leaves out and those whose values differ
+    (sport series for example carry the year in their series title), so
+    expand_schedule() gives every episode back exactly the keys it had.
+
+    Returns:
+        dict: The format 2 content.
+    """
+    series = {}
+    episodes = {}
+    for pid, item in schedule.items():
+        if pid == 'date' or not isinstance(item, dict):
+            continue
+        sid = item.get('sid')
+        if sid is None:
+            continue
+        record = series.get(sid)
+        if record is None:
+            series[sid] = {field: item[field] for field in SERIES_FIELDS if field in item}
+        else:
+            for field in [field for field in record if field not in item]:
+                del record[field]
+
+    for pid, item in schedule.items():
+        if pid == 'date' or not isinstance(item, dict):
+            continue
+        record = series.get(item.get('sid'), {})
+        episodes[pid] = {key: value for key, value in item.items() if key not in record or record[key] != value}
+
+    content = {'format': SCHEDULE_FORMAT_V2, 'series': series, 'episodes': episodes}
+    if 'date' in schedule:
+        content['date'] = schedule['date']
+    return content
+
+
+def expand_schedule(content):
+    """
+    Turn parsed schedule content of either format into the format 1 dictionary.
+    """
+    if not is_normalized(content):
+        return content
+    series = content['series']
+    schedule = {}
+    for pid, episode in content['episodes'].items():
+        record = series.get(episode.get('sid'))
+        schedule[pid] = {**record, **episode} if record else episode
+    if 'date' in content:
+        schedule['date'] = content['date']
+    return schedule
+
+
+def load_schedule(file_name):
+    """
+    Load a schedule file of either format with its journal applied.
+
+    Returns:
+        tuple: The format 1 schedule dictionary and the journal offset for read_journal().
+    """
+    schedule = _load_without_gc(expand_schedule, load_json(file_name))
+    records, offset = read_journal(file_name)
+    apply_journal(schedule, records)
+    return schedule, offset
+
+
+def write_schedule(file_name, schedule, compress=False, schedule_format=None):
+    """
+    Write a full schedule, replacing its journal and refreshing its snapshot.
+
+    Args:
+        file_name (str): Path of the schedule file.
+        schedule (dict): The format 1 schedule dictionary.
+        compress (bool): Gzip compress the file.
+        schedule_format (int, optional): 1 or 2, defaults to the format of the existing file.
+
+    Returns:
+        dict: The sidecar content.
+    """
+    if schedule_format is None:
+        schedule_format = (read_meta(file_name) or {}).get('format', FORMAT_VERSION)
+    content = normalize_schedule(schedule) if schedule_format == SCHEDULE_FORMAT_V2 else schedule
+    items = sum(1 for key in schedule if key != 'date')
+
+    # The journal goes before the new json file is in place, records written on top of the old file must never be
+    # applied to the new one by a reader that sees the new file before its sidecar. Until the new file is in place
+    # readers see the old file without the journaled changes, the fingerprints are dropped with them so a write that
+    # does not complete makes the next refresh download those series again.
+    _remove(fingerprints_path(file_name))
+    clear_journal(file_name)
+    meta = write_json(file_name, content, compress, items, schedule_format)
+    # The snapshot lets the next load skip parsing the json file
+    write_snapshot(file_name, content)
+    return meta
+
+
+def upsert_record(sid, items):
+    """A journal record replacing all episodes of a series with the given ones"""
+    return {'op': 'upsert', 'sid': str(sid), 'items': items}
+
+
+def delete_record(sid):
+    """A journal record removing all episodes of a series"""
+    return {'op': 'delete', 'sid': str(sid)}
+
+
+def apply_journal(schedule, records):
+    """
+    Apply journal records to a schedule dictionary in place.
+
+    Args:
+        schedule (dict): Schedule items keyed by pid, the items only need a get() method.
+        records (list): Records made by upsert_record() and delete_record().
+    """
+    if not records:
+        return
+    series_pids = {}
+    pid_series = {}
+    for pid, item in schedule.items():
+        if pid != 'date' and hasattr(item, 'get'):
+            sid = pid_series[pid] = str(item.get('sid'))
+            series_pids.setdefault(sid, set()).add(pid)
+
+    for record in records:
+        sid = record['sid']
+        for pid in series_pids.pop(sid, ()):
+            schedule.pop(pid, None)
+            del pid_series[pid]
+        if record['op'] == 'upsert':
+            # An episode that moved here from another series is no longer one of that series' episodes
+            for pid in record['items']:
+                previous = pid_series.get(pid)
+                if previous is not None:
+                    series_pids[previous].discard(pid)
+                pid_series[pid] = sid
+            schedule.update(record['items'])
+            series_pids[sid] = set(record['items'])
+
+
+def append_journal(file_name, records):
+    """
+    Append records to the journal of a json file.
+
+    Records are only journaled on top of a json file written by write_json()
+    and while the journal is below JOURNAL_MAX_BYTES.
+
+    Returns:
+        bool: False if the caller has to write the full json file instead.
+    """
+    meta = read_meta(file_name)
+    if meta is None:
+        return False
+    target = journal_path(file_name)
+    try:
+        if os.path.getsize(target) > JOURNAL_MAX_BYTES:
+            return False
+    except OSError:
+        pass
+
+    lines = ''.join(
+        json.dumps({'base': meta['version'], **record}, ensure_ascii=False, separators=(',', ':')) + '\n'
+        for record in records
+    )
+    with open(target, 'a', encoding='utf-8') as journal:
+        journal.write(lines)
+        journal.flush()
+        os.fsync(journal.fileno())
+    return True
+
+
+def read_journal(file_name, offset=0):
+    """
+    Read the journal records written on top of the current json file.
+
+    Args:
+        file_name (str): Path of the json file.
+        offset (int): Byte offset to continue reading from, returned by an earlier call.
+
+    Returns:
+        tuple: The records and the offset after the last complete record, or
+        (None, 0) if the journal no longer continues from the offset.
+    """
+    meta = read_meta(file_name)
+    try:
+        with open(journal_path(file_name), 'rb') as journal:
+            journal.seek(0, os.SEEK_END)
+            if journal.tell() < offset:
+                return None, 0
+            journal.seek(offset)
+            data = journal.read()
+    except OSError:
+        return ([], 0) if offset == 0 else (None, 0)
+
+    # A record without its line end is still being written
+    complete = data.rfind(b'\n') + 1
+    records = []
+    for line in data[:complete].splitlines():
+        record = json.loads(line)
+        # Records written on top of an older json file are already part of the current one
+        if meta is not None and record.get('base') == meta['version']:
+            records.append(record)
+    return records, offset + complete
+
+
+def _remove(file_name):
+    try:
+        os.remove(file_name)
+    except OSError:
+        pass
+
+
+def clear_journal(file_name):
+    """Remove the journal, before its records are written into the json file"""
+    _remove(journal_path(file_name))
+
+
+def copy_schedule(file_name, target):
+    """
+    Copy a schedule file with its sidecar and journal, replacing every copy atomically.
+
+    As in write_schedule() the journal at the target goes first and is copied
+    last, a reader never applies a journal to a json file it was not written on.
+
+    Args:
+        file_name (str): Path of the schedule file.
+        target (str): Path of the copy.
+    """
+    def copy(source):
+        def write(raw):
+            with open(source, 'rb') as in_file:
+                shutil.copyfileobj(in_file, raw)
+        return write
+
+    clear_journal(target)
+    for source, copy_name in ((file_name, target), (meta_path(file_name), meta_path(target))):
+        if os.path.exists(source):
+            _replace_file(copy_name, copy(source))
+        else:
+            _remove(copy_name)
+    if os.path.exists(journal_path(file_name)):
+        _replace_file(journal_path(target), copy(journal_path(file_name)))
+
+
+def last_refreshed(file_name):
+    """
+    Time of the last refresh saved to a schedule file.
+
+    An incremental refresh only appends to the journal, and one that found no
+    changes only rewrites the fingerprints, so the newest modification time of
+    the json file, its sidecar, journal and fingerprints counts.
+
+    Returns:
+        float: Seconds since the epoch, or None if the schedule file does not exist.
+    """
+    times = []
+    for path in (file_name, meta_path(file_name), journal_path(file_name), fingerprints_path(file_name)):
+        try:
+            times.append(os.path.getmtime(path))
+        except OSError:
+            if path == file_name:
+                return None
+    return max(times)
+
+
+def program_fingerprint(program):
+    """
+    Fingerprint of a series entry in the program listing.
+
+    The listing entry carries the number of available episodes and the
+    update markers of the series, any change to it changes the fingerprint.
+
+    Returns:
+        str: The fingerprint.
+    """
+    data = json.dumps(program, sort_keys=True, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+def read_fingerprints(file_name):
+    """
+    Read the series fingerprints recorded for a json file.
+
+    Returns:
+        dict: Fingerprints keyed by sid, or None if there are none for the
+        current version of the json file.
+    """
+    meta = read_meta(file_name)
+    try:
+        with open(fingerprints_path(file_name), 'r', encoding='utf-8') as in_file:
+            content = json.load(in_file)
+    except (OSError, ValueError):
+        return None
+    # Fingerprints recorded against an older write of the json file describe another schedule
+    if meta is None or content.get('base') != meta.get('version'):
+        return None
+    return content.get('series', {})
+
+
+def write_fingerprints(file_name, fingerprints):
+    """Record the series fingerprints for the current version of a json file"""
+    meta = read_meta(file_name)
+    if meta is None:
+        return
+    content = {'base': meta.get('version'), 'series': fingerprints}
+    _replace_file(fingerprints_path(file_name), lambda out_file: out_file.write(
+        json.dumps(content, separators=(',', ':')).encode('utf-8')))
+
+
+@contextlib.contextmanager
+def refresh_lock(file_name, on_wait=None):
+    """
+    Hold the lock that lets one refresh of a json file run at a time.
+
+    The lock is taken on a file next to the json file, so it also keeps out
+    refreshes in other processes and on other threads of this one. It is
+    released when the process exits, even if it is killed.
+
+    Args:
+        file_name (str): The json file about to be refreshed.
+        on_wait (callable, optional): Called before waiting if another refresh holds the lock.
+
+    Yields:
+        bool: Whether another refresh held the lock, which means the json file
+        was probably just refreshed by it.
+    """
+    if fcntl is None:
+        yield False
+        return
+
+    directory = os.path.dirname(os.path.abspath(file_name))
+    os.makedirs(directory, exist_ok=True)
+    with open(lock_path(file_name), 'a') as lock_file:
+        waited = False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            waited = True
+            if on_wait is not None:
+                on_wait()
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield waited
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def benchmark(file_name, repeat=5):
+    """
+    Time cold loads of a schedule written in both formats, from json and from the snapshot.
+
+    The schedule is copied to temporary files next to it, the original is not touched.
+
+    Returns:
+        dict: File size in bytes and best load time in seconds for each format.
+    """
+    schedule = expand_schedule(load_json(file_name, snapshot=False))
+
+    def best(load):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            load()
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def load_text(copy_name):
+        with _open_text(copy_name) as in_file:
+            return _load_without_gc(expand_schedule, _load_without_gc(json.load, in_file))
+
+    results = {}
+    for schedule_format in (FORMAT_VERSION, SCHEDULE_FORMAT_V2):
+        copy_name = '{0}.benchmark-v{1}'.format(file_name, schedule_format)
+        try:
+            meta = write_schedule(copy_name, schedule, schedule_format=schedule_format)
+            results['v{0}'.format(schedule_format)] = {
+                'size': meta['size'],
+                'json': best(lambda: load_text(copy_name)),
+                'snapshot': best(lambda: expand_schedule(read_snapshot(copy_name)))
+            }
+        finally:
+            for name in (copy_name, meta_path(copy_name), snapshot_path(copy_name)):
+                try:
+                    os.remove(name)
+                except OSError:
+                    pass
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark or migrate a tv schedule file")
+    parser.add_argument("file", help="Path to tvschedule.json")
+    parser.add_argument("--migrate", help="Rewrite the schedule in the given format", type=int, choices=[FORMAT_VERSION, SCHEDULE_FORMAT_V2])
+    parser.add_argument("--compress", help="Gzip compress the migrated schedule", action="store_true")
+    args = parser.parse_args()
+
+    if args.migrate is not None:
+        schedule, _ = load_schedule(args.file)
+        meta = write_schedule(args.file, schedule, args.compress, args.migrate)
+        print("Wrote {0} items in format {1} ({2:.1f} MiB)".format(meta['items'], meta['format'], meta['size'] / 2**20))
+    else:
+        for name, result in benchmark(args.file).items():
+            print("{0}: {1:.1f} MiB, json {2:.3f}s, snapshot {3:.3f}s".format(
+                name, result['size'] / 2**20, result['json'], result['snapshot']))
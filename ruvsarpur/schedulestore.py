@@ -0,0 +1,240 @@
+"""
+SQLite backed storage for the tv schedule.
+
+The schedule is kept in a series table, an episodes table and an FTS5 index
+over the episode titles and descriptions so single items, whole series and
+text matches can be looked up without loading the full schedule. Episodes are
+stored as the same JSON objects that tvschedule.json holds, which keeps
+read_schedule() a drop-in replacement for parsing the json file.
+"""
+import json
+import sqlite3
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS series (
+    sid TEXT PRIMARY KEY,
+    series_title TEXT,
+    original_title TEXT,
+    categories TEXT
+);
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    pid TEXT NOT NULL UNIQUE,
+    sid TEXT,
+    showtime TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_sid ON episodes (sid);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS episodes_fts USING fts5 (
+    title, series_title, original_title, description,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+# Rows are written in batches of this size when a schedule is saved
+WRITE_BATCH_SIZE = 1000
+
+
+def has_fts5():
+    """
+    Check whether the linked SQLite library was built with FTS5.
+
+    Returns:
+        bool: True if FTS5 virtual tables can be created.
+    """
+    with closing(sqlite3.connect(':memory:')) as connection:
+        try:
+            connection.execute('CREATE VIRTUAL TABLE probe USING fts5 (text)')
+        except sqlite3.OperationalError:
+            return False
+    return True
+
+
+def _fts_query(text):
+    """Turn free text into an FTS5 query matching every word as a prefix"""
+    words = [word.replace('"', '') for word in text.split()]
+    return ' '.join('"{0}"*'.format(word) for word in words if word)
+
+
+class ScheduleStore:
+    """
+    A tv schedule kept in a SQLite database file.
+
+    Args:
+        path (str): Location of the database file, it is created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+        self.fts = has_fts5()
+        if self.fts:
+            self.connection.executescript(FTS_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM episodes').fetchone()[0]
+
+    def _insert_episodes(self, episodes, sid=None):
+        """Insert episodes with their series records and text index rows"""
+        series = {}
+        for item in episodes:
+            if item.get('sid') is not None and item['sid'] not in series:
+                series[item['sid']] = (
+                    item['sid'],
+                    item.get('series_title'),
+                    item.get('original-title'),
+                    json.dumps(item.get('categories'), ensure_ascii=False)
+                )
+        self.connection.executemany('INSERT OR REPLACE INTO series VALUES (?, ?, ?, ?)', series.values())
+
+        for start in range(0, len(episodes), WRITE_BATCH_SIZE):
+            batch = episodes[start:start + WRITE_BATCH_SIZE]
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO episodes (pid, sid, showtime, data) VALUES (?, ?, ?, ?)',
+                ((str(item['pid']), item.get('sid'), item.get('showtime'), json.dumps(item, ensure_ascii=False)) for item in batch)
+            )
+        if self.fts:
+            self.connection.execute(
+                "INSERT INTO episodes_fts (rowid, title, series_title, original_title, description) "
+                "SELECT id, json_extract(data, '$.title'), json_extract(data, '$.series_title'), "
+                "json_extract(data, '$.\"original-title\"'), json_extract(data, '$.desc') FROM episodes"
+                + (' WHERE sid = ?' if sid is not None else ''),
+                () if sid is None else (sid,)
+            )
+
+    def write_schedule(self, schedule):
+        """
+        Replace the stored schedule with a full schedule dictionary.
+
+        Args:
+            schedule (dict): Episodes keyed by pid plus the 'date' entry.
+        """
+        episodes = [item for item in schedule.values() if isinstance(item, dict) and 'pid' in item]
+
+        with self.connection:
+            self.connection.execute('DELETE FROM episodes')
+            self.connection.execute('DELETE FROM series')
+            if self.fts:
+                self.connection.execute('DELETE FROM episodes_fts')
+            self._insert_episodes(episodes)
+
+            if 'date' in schedule:
+                self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('date', ?)", (str(schedule['date']),))
+
+    def apply_journal(self, records):
+        """
+        Apply schedule journal records, replacing or removing whole series.
+
+        Args:
+            records (list): Records made by schedulefile.upsert_record() and schedulefile.delete_record().
+        """
+        with self.connection:
+            for record in records:
+                sid = record['sid']
+                episodes = [item for item in record['items'].values() if 'pid' in item] if record['op'] == 'upsert' else []
+                # Episodes that moved here from another series are removed by pid, with their text index rows
+                pids = [(str(item['pid']),) for item in episodes]
+                if self.fts:
+                    self.connection.execute('DELETE FROM episodes_fts WHERE rowid IN (SELECT id FROM episodes WHERE sid = ?)', (sid,))
+                    self.connection.executemany('DELETE FROM episodes_fts WHERE rowid IN (SELECT id FROM episodes WHERE pid = ?)', pids)
+                self.connection.execute('DELETE FROM episodes WHERE sid = ?', (sid,))
+                self.connection.executemany('DELETE FROM episodes WHERE pid = ?', pids)
+                self.connection.execute('DELETE FROM series WHERE sid = ?', (sid,))
+                if episodes:
+                    self._insert_episodes(episodes, sid)
+
+    def read_schedule(self, pids=None, sids=None):
+        """
+        Read the stored schedule back into the tvschedule.json structure.
+
+        Args:
+            pids (list, optional): Only read the episodes with these program ids.
+            sids (list, optional): Only read the episodes of these series.
+
+        Returns:
+            dict: Episodes keyed by pid plus the 'date' entry, or None if the store is empty.
+        """
+        date = self.connection.execute("SELECT value FROM meta WHERE key = 'date'").fetchone()
+        if date is None:
+            return None
+
+        if pids is not None or sids is not None:
+            rows = self.get_episodes(pids or [], sids or [])
+        else:
+            rows = (json.loads(data) for (data,) in self.connection.execute('SELECT data FROM episodes'))
+
+        schedule = {item['pid']: item for item in rows}
+        schedule['date'] = date[0]
+        return schedule
+
+    def get_episodes(self, pids=(), sids=()):
+        """
+        Look up episodes by program id or series id.
+
+        Returns:
+            list: The matching episode dictionaries.
+        """
+        episodes = []
+        for column, values in (('pid', pids), ('sid', sids)):
+            values = [str(value) for value in values]
+            if not values:
+                continue
+            placeholders = ','.join('?' * len(values))
+            rows = self.connection.execute(
+                'SELECT data FROM episodes WHERE {0} IN ({1}) ORDER BY showtime DESC'.format(column, placeholders),
+                values
+            )
+            episodes.extend(json.loads(data) for (data,) in rows)
+        return episodes
+
+    def search(self, text, limit=50):
+        """
+        Full text search over titles and descriptions, best matches first.
+
+        Every word of the text matches words starting with it. Falls back to a
+        substring match on titles when FTS5 is unavailable.
+
+        Args:
+            text (str): The text to search for.
+            limit (int, optional): Most matches returned, None for all of them.
+
+        Returns:
+            list: Program ids of the matching episodes.
+        """
+        # A negative limit is no limit to SQLite
+        limit = -1 if limit is None else limit
+        if self.fts:
+            query = _fts_query(text)
+            if not query:
+                return []
+            rows = self.connection.execute(
+                'SELECT episodes.pid FROM episodes_fts JOIN episodes ON episodes.id = episodes_fts.rowid '
+                'WHERE episodes_fts MATCH ? ORDER BY bm25(episodes_fts, 10.0, 10.0, 5.0, 1.0) LIMIT ?',
+                (query, limit)
+            )
+        else:
+            rows = self.connection.execute(
+                "SELECT pid FROM episodes WHERE json_extract(data, '$.title') LIKE ? ORDER BY showtime DESC LIMIT ?",
+                ('%' + text + '%', limit)
+            )
+        return [pid for (pid,) in rows]
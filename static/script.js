@@ -1,6 +1,7 @@
 document.addEventListener('DOMContentLoaded', () => {
     const searchForm = document.getElementById('searchForm');
     const searchInput = document.getElementById('searchInput');
+    const suggestionsList = document.getElementById('searchSuggestions');
     const resultsDiv = document.getElementById('results');
     const loadingDiv = document.getElementById('loading');
     const themeToggle = document.getElementById('themeToggle');
@@ -9,6 +10,9 @@ document.addEventListener('DOMContentLoaded', () => {
     const epgStatusText = document.getElementById('epgStatusText');
     const downloadEpgBtn = document.getElementById('downloadEpgBtn');
     let debounceTimer;
+    let suggestTimer;
+    let currentQuery = '';
+    let nextCursor = null;
     
     // Make activeDownloads globally accessible
     if (!window.activeDownloads) {
@@ -21,7 +25,13 @@ document.addEventListener('DOMContentLoaded', () => {
             const response = await fetch('/api/epg-status');
             const data = await response.json();
             
-            if (data.epg_available) {
+            if (data.refresh_job) {
+                // A refresh is running, e.g. the first one after startup, its series are searchable as they arrive
+                downloadEpgBtn.disabled = true;
+                downloadEpgBtn.textContent = 'Downloading EPG...';
+                epgStatusDiv.className = 'alert alert-info mb-4';
+                followEpgJob(data.refresh_job);
+            } else if (data.epg_available) {
                 epgStatusDiv.className = 'alert alert-success mb-4';
                 epgStatusText.innerHTML = `
                     ✅ EPG data available (${data.epg_size_mb} MB, ${data.schedule_items} shows)
@@ -44,49 +54,83 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
-    async function downloadEpg() {
-        downloadEpgBtn.disabled = true;
-        downloadEpgBtn.textContent = 'Downloading EPG...';
-        epgStatusDiv.className = 'alert alert-info mb-4';
+    function formatEta(seconds) {
+        if (seconds === null || seconds === undefined) {
+            return 'estimating time left';
+        }
+        const minutes = Math.floor(seconds / 60);
+        return minutes > 0 ? `about ${minutes} min ${Math.round(seconds % 60)} s left` : `about ${Math.round(seconds)} s left`;
+    }
+
+    function showEpgFailure(message) {
+        epgStatusDiv.className = 'alert alert-danger mb-4';
         epgStatusText.innerHTML = `
-            ⏳ Downloading EPG data, please wait (this may take 5-8 minutes)...
-            <br><small class="text-muted">Do not close this page during download.</small>
+            ❌ EPG download failed: ${message}
+            <br><small class="text-muted">Please try again or check the logs.</small>
         `;
-        
+        downloadEpgBtn.disabled = false;
+        downloadEpgBtn.textContent = 'Retry Download';
+    }
+
+    // Polls an EPG refresh job until it finishes, showing its progress meanwhile
+    async function followEpgJob(jobId) {
         try {
-            const response = await fetch('/api/download-epg', { method: 'POST' });
-            const data = await response.json();
+            const response = await fetch(`/api/download-epg/${jobId}`);
+            const job = await response.json();
             
-            if (data.status === 'success') {
+            if (!response.ok) {
+                showEpgFailure(job.detail || job.message || 'Unknown refresh job');
+            } else if (job.status === 'success') {
                 epgStatusDiv.className = 'alert alert-success mb-4';
                 epgStatusText.innerHTML = `
-                    ✅ EPG data downloaded successfully! (${data.schedule_items} shows available)
+                    ✅ EPG data downloaded successfully! (${job.schedule_items} shows available)
                     <br><small class="text-muted">You can now search and download shows.</small>
                 `;
                 downloadEpgBtn.classList.add('d-none');
+            } else if (job.status === 'error') {
+                showEpgFailure(job.message);
             } else {
-                epgStatusDiv.className = 'alert alert-danger mb-4';
+                const detail = job.phase === 'series'
+                    ? `${job.series_done} of ${job.series_total} series, ${job.requests_per_second} requests/s, ${job.series_failed + job.request_errors} errors, ${formatEta(job.eta)}`
+                    : job.phase === 'saving' ? 'Saving the schedule' : 'Reading the program catalog';
                 epgStatusText.innerHTML = `
-                    ❌ EPG download failed: ${data.message}
-                    <br><small class="text-muted">${data.stderr || ''}</small>
+                    ⏳ Downloading EPG data...
+                    <br><small class="text-muted">${detail}</small>
                 `;
-                downloadEpgBtn.disabled = false;
-                downloadEpgBtn.textContent = 'Retry Download';
+                setTimeout(() => followEpgJob(jobId), 2000);
+            }
+        } catch (error) {
+            // The job keeps running in the backend, keep asking
+            console.error('Error checking EPG refresh job:', error);
+            setTimeout(() => followEpgJob(jobId), 5000);
+        }
+    }
+
+    async function downloadEpg() {
+        downloadEpgBtn.disabled = true;
+        downloadEpgBtn.textContent = 'Downloading EPG...';
+        epgStatusDiv.className = 'alert alert-info mb-4';
+        epgStatusText.innerHTML = `
+            ⏳ Starting EPG download...
+        `;
+        
+        try {
+            const response = await fetch('/api/download-epg', { method: 'POST' });
+            const data = await response.json();
+            
+            if (data.status === 'started') {
+                followEpgJob(data.job_id);
+            } else {
+                showEpgFailure(data.message);
             }
         } catch (error) {
             console.error('Error downloading EPG:', error);
-            epgStatusDiv.className = 'alert alert-danger mb-4';
-            epgStatusText.innerHTML = `
-                ❌ Error downloading EPG data: ${error.message}
-                <br><small class="text-muted">Please try again or check the logs.</small>
-            `;
-            downloadEpgBtn.disabled = false;
-            downloadEpgBtn.textContent = 'Retry Download';
+            showEpgFailure(error.message);
         }
     }
 
     // Initialize EPG status check
-    // checkEpgStatus();  // Temporarily disabled to avoid 404 errors
+    checkEpgStatus();
     
     // Add EPG download button event listener
     downloadEpgBtn.addEventListener('click', downloadEpg);
@@ -117,24 +161,88 @@ document.addEventListener('DOMContentLoaded', () => {
     // Add theme toggle event listener
     themeToggle.addEventListener('click', toggleTheme);
 
-    // Remove the form submit event listener since we'll search on input
-    searchForm.addEventListener('submit', (e) => e.preventDefault());
+    // Submitting the form (pressing Enter) commits to the query and runs the search
+    searchForm.addEventListener('submit', (e) => {
+        e.preventDefault();
+        scheduleSearch(0);
+    });
+
+    // Facet filter chips, combined with the query or browsed on their own
+    const facetChips = document.querySelectorAll('#facetFilters .facet-chip');
+    const activeFacets = new Set();
+
+    facetChips.forEach(chip => {
+        chip.addEventListener('click', () => {
+            const flag = chip.dataset.flag;
+            if (activeFacets.has(flag)) {
+                activeFacets.delete(flag);
+                chip.classList.remove('active');
+            } else {
+                activeFacets.add(flag);
+                chip.classList.add('active');
+            }
+            scheduleSearch(0);
+        });
+    });
+
+    function updateFacetCounts(facets) {
+        facetChips.forEach(chip => {
+            const count = facets ? facets[chip.dataset.flag] : undefined;
+            chip.querySelector('.facet-count').textContent = count !== undefined ? count : '';
+        });
+    }
+
+    // Typing only asks for title suggestions, the search runs once a query is committed
+    searchInput.addEventListener('input', (e) => {
+        // Picking an entry from the suggestion list commits to it straight away
+        if (!(e instanceof InputEvent) || e.inputType === 'insertReplacementText') {
+            scheduleSearch(0);
+            return;
+        }
+
+        clearTimeout(suggestTimer);
+        const prefix = searchInput.value.trim();
+        if (prefix.length < 2) {
+            suggestionsList.innerHTML = '';
+            return;
+        }
+        suggestTimer = setTimeout(() => fetchSuggestions(prefix), 100);
+    });
+
+    async function fetchSuggestions(prefix) {
+        try {
+            const response = await fetch(`/suggest?prefix=${encodeURIComponent(prefix)}`);
+            const data = await response.json();
+            if (!response.ok || prefix !== searchInput.value.trim()) return;
 
-    // Add input event listener for instant search
-    searchInput.addEventListener('input', () => {
+            suggestionsList.innerHTML = '';
+            (data.suggestions || []).forEach(suggestion => {
+                const option = document.createElement('option');
+                option.value = suggestion.title;
+                option.label = `${suggestion.episodes} episode${suggestion.episodes === 1 ? '' : 's'}`;
+                suggestionsList.appendChild(option);
+            });
+        } catch (error) {
+            console.error('Suggestion error:', error);
+        }
+    }
+
+    function scheduleSearch(delay) {
         const query = searchInput.value.trim();
         
         // Clear any pending searches
         clearTimeout(debounceTimer);
         
-        // Don't search if less than 2 characters
-        if (query.length < 2) {
+        // Don't search if less than 2 characters, unless browsing by facets
+        if (query.length < 2 && activeFacets.size === 0) {
             resultsDiv.innerHTML = `
                 <div class="search-hint">
                     <i class="bi bi-tv"></i>
-                    Type at least 2 characters to search…
+                    Type at least 2 characters and press Enter to search…
                 </div>`;
             loadingDiv.classList.add('d-none');
+            currentQuery = '';
+            updateFacetCounts(null);
             return;
         }
 
@@ -143,84 +251,244 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // Debounce the search to avoid too many API calls
         debounceTimer = setTimeout(async () => {
+            const url = buildResultsUrl(query.length >= 2 ? query : '');
             try {
-                const response = await fetch(`/search?q=${encodeURIComponent(query)}`);
-                const data = await response.json();
-                console.log('Search response:', data);
-
-                if (response.ok) {
-                    displayResults(data);
-                } else {
-                    throw new Error(data.error || 'Search failed');
-                }
+                currentQuery = url;
+                const data = await fetchResultsPage(url, null);
+                if (url !== currentQuery) return; // A newer search has started
+                displayResults(data, false);
+                updateFacetCounts(data.facets);
             } catch (error) {
                 console.error('Search error:', error);
                 showError(error.message);
             } finally {
                 loadingDiv.classList.add('d-none');
             }
-        }, 300);
-    });
+        }, delay);
+    }
+
+    // Search when there is a query, otherwise browse the active facets
+    function buildResultsUrl(query) {
+        let url = query
+            ? `/search?q=${encodeURIComponent(query)}&group=series&fuzzy=true`
+            : '/browse?group=series';
+        activeFacets.forEach(flag => {
+            url += `&${flag}=true`;
+        });
+        return url;
+    }
+
+    // Fetch a single page of ranked search results
+    async function fetchResultsPage(url, cursor) {
+        if (cursor) {
+            url += `&cursor=${encodeURIComponent(cursor)}`;
+        }
+        const response = await fetch(url);
+        const data = await response.json();
+        console.log(`Search page: ${(data.results || []).length} of ${data.total} results`);
+
+        if (!response.ok) {
+            throw new Error(data.error || 'Search failed');
+        }
+        return data;
+    }
+
+    async function loadMoreResults(button) {
+        button.disabled = true;
+        button.innerHTML = '<span class="spinner-border spinner-border-sm me-1"></span>Loading…';
+        try {
+            const url = currentQuery;
+            const data = await fetchResultsPage(url, nextCursor);
+            if (url !== currentQuery) return;
+            displayResults(data, true);
+        } catch (error) {
+            console.error('Search error:', error);
+            showError(error.message);
+        }
+    }
 
     function thumbUrl(url) {
         if (!url) return null;
         return url.replace('/2048x/', '/300x/').replace('/480x/', '/300x/');
     }
 
-    function displayResults(results) {
-        resultsDiv.innerHTML = '';
+    function displayResults(data, append) {
+        const results = (data && data.results) || [];
+        nextCursor = data ? data.next_cursor : null;
 
-        if (!Array.isArray(results) || results.length === 0) {
-            resultsDiv.innerHTML = `
-                <div class="search-hint">
-                    <i class="bi bi-search"></i>
-                    No results found. Try a different search term.
-                </div>`;
-            return;
+        const previousMore = document.getElementById('loadMoreResults');
+        if (previousMore) previousMore.remove();
+
+        if (!append) {
+            resultsDiv.innerHTML = '';
+
+            if (results.length === 0) {
+                resultsDiv.innerHTML = `
+                    <div class="search-hint">
+                        <i class="bi bi-search"></i>
+                        No results found. Try a different search term.
+                    </div>`;
+                return;
+            }
         }
 
         results.forEach(result => {
-            const title = result.title || result.name || 'Untitled';
-            const description = result.description || result.desc || '';
-            const id = result.pid || result.id || '';
-            const safeTitle = title.replace(/'/g, "\\'");
-            const img = thumbUrl(result.image);
-
-            const thumb = img
-                ? `<img src="${img}" alt="" loading="lazy" onerror="this.parentElement.innerHTML='<div class=\\'result-thumb-placeholder\\'><i class=\\'bi bi-film\\'></i></div>'">`
-                : `<div class="result-thumb-placeholder"><i class="bi bi-film"></i></div>`;
-
-            const seriesLine = (result.series_title && result.series_title !== title)
-                ? `<div class="result-series">${result.series_title}${result.episode_info ? ' · ' + result.episode_info : ''}</div>`
-                : (result.episode_info ? `<div class="result-series">${result.episode_info}</div>` : '');
-
-            const badges = [
-                result.is_movie   ? `<span class="badge-pill accent"><i class="bi bi-film"></i> Movie</span>` : '',
-                result.is_docu    ? `<span class="badge-pill accent"><i class="bi bi-camera-reels"></i> Documentary</span>` : '',
-                result.is_sport   ? `<span class="badge-pill accent"><i class="bi bi-trophy"></i> Sport</span>` : '',
-                result.has_subtitles ? `<span class="badge-pill success"><i class="bi bi-badge-cc"></i> Subtitles</span>` : '',
-                result.duration   ? `<span class="badge-pill"><i class="bi bi-clock"></i> ${result.duration}</span>` : '',
-            ].filter(Boolean).join('');
-
-            const item = document.createElement('div');
-            item.className = 'result-card';
-            item.innerHTML = `
-                <div class="result-thumb">${thumb}</div>
-                <div class="result-body">
-                    <div class="result-title">${title}</div>
-                    ${seriesLine}
-                    ${description ? `<div class="result-desc">${description}</div>` : ''}
-                    <div class="result-meta">${badges}</div>
-                </div>
-                <div class="result-actions">
-                    <button class="btn-download"
-                            onclick="downloadShow('${id}', '${safeTitle}', this)"
-                            data-pid="${id}">
-                        <i class="bi bi-download me-1"></i>Download
-                    </button>
-                </div>`;
-            resultsDiv.appendChild(item);
+            // Series with a single episode (movies mostly) are shown as a plain result
+            if (result.episode_count === 1 && result.latest_episodes && result.latest_episodes.length === 1) {
+                resultsDiv.appendChild(createResultCard(result.latest_episodes[0]));
+            } else if (result.latest_episodes) {
+                resultsDiv.appendChild(createSeriesCard(result));
+            } else {
+                resultsDiv.appendChild(createResultCard(result));
+            }
         });
+
+        if (nextCursor) {
+            const shown = resultsDiv.querySelectorAll(':scope > .result-card').length;
+            const more = document.createElement('div');
+            more.id = 'loadMoreResults';
+            more.className = 'text-center py-3';
+            more.innerHTML = `
+                <button class="btn btn-outline-primary btn-sm">
+                    Show more results (${shown} of ${data.total})
+                </button>`;
+            more.querySelector('button').addEventListener('click', (e) => loadMoreResults(e.currentTarget));
+            resultsDiv.appendChild(more);
+        }
+    }
+
+    function createBadges(result) {
+        return [
+            result.is_movie   ? `<span class="badge-pill accent"><i class="bi bi-film"></i> Movie</span>` : '',
+            result.is_docu    ? `<span class="badge-pill accent"><i class="bi bi-camera-reels"></i> Documentary</span>` : '',
+            result.is_sport   ? `<span class="badge-pill accent"><i class="bi bi-trophy"></i> Sport</span>` : '',
+            result.has_subtitles ? `<span class="badge-pill success"><i class="bi bi-badge-cc"></i> Subtitles</span>` : '',
+            result.duration   ? `<span class="badge-pill"><i class="bi bi-clock"></i> ${result.duration}</span>` : '',
+        ].filter(Boolean).join('');
+    }
+
+    function createThumb(image) {
+        const img = thumbUrl(image);
+        return img
+            ? `<img src="${img}" alt="" loading="lazy" onerror="this.parentElement.innerHTML='<div class=\\'result-thumb-placeholder\\'><i class=\\'bi bi-film\\'></i></div>'">`
+            : `<div class="result-thumb-placeholder"><i class="bi bi-film"></i></div>`;
+    }
+
+    function createEpisodeRow(episode) {
+        const title = episode.episode_title || episode.title || 'Untitled';
+        const id = episode.pid || '';
+        const safeTitle = (episode.title || title).replace(/'/g, "\\'");
+        const info = [episode.showtime ? episode.showtime.substring(0, 10) : '', episode.duration || '']
+            .filter(Boolean).join(' · ');
+
+        const row = document.createElement('div');
+        row.className = 'series-episode';
+        row.innerHTML = `
+            <div class="series-episode-title">
+                ${title}
+                ${info ? `<span class="series-episode-info">${info}</span>` : ''}
+            </div>
+            <button class="btn-download btn-download-sm"
+                    onclick="downloadShow('${id}', '${safeTitle}', this)"
+                    data-pid="${id}">
+                <i class="bi bi-download"></i>
+            </button>`;
+        return row;
+    }
+
+    function createSeriesCard(series) {
+        const title = series.series_title || 'Untitled';
+        const episodeLabel = series.matching_episodes === series.episode_count
+            ? `${series.episode_count} episodes`
+            : `${series.matching_episodes} of ${series.episode_count} episodes match`;
+
+        const item = document.createElement('div');
+        item.className = 'result-card';
+        item.innerHTML = `
+            <div class="result-thumb">${createThumb(series.image)}</div>
+            <div class="result-body">
+                <div class="result-title">${title}</div>
+                <div class="result-series">${episodeLabel}</div>
+                ${series.series_desc ? `<div class="result-desc">${series.series_desc}</div>` : ''}
+                <div class="result-meta">${createBadges(series)}</div>
+                <div class="series-episodes"></div>
+                <button class="btn btn-link btn-sm px-0 series-more">
+                    Show all ${series.episode_count} episodes
+                </button>
+            </div>`;
+
+        const episodesDiv = item.querySelector('.series-episodes');
+        series.latest_episodes.forEach(episode => episodesDiv.appendChild(createEpisodeRow(episode)));
+
+        const moreButton = item.querySelector('.series-more');
+        let episodesCursor = null;
+        moreButton.addEventListener('click', async () => {
+            moreButton.disabled = true;
+            try {
+                let url = `/series/${encodeURIComponent(series.series_id)}/episodes`;
+                if (episodesCursor) {
+                    url += `?cursor=${encodeURIComponent(episodesCursor)}`;
+                } else {
+                    episodesDiv.innerHTML = '';
+                }
+                const response = await fetch(url);
+                const data = await response.json();
+                if (!response.ok) {
+                    throw new Error(data.error || 'Episode listing failed');
+                }
+
+                data.results.forEach(episode => episodesDiv.appendChild(createEpisodeRow(episode)));
+                episodesCursor = data.next_cursor;
+                if (episodesCursor) {
+                    moreButton.disabled = false;
+                    moreButton.textContent = `Show more episodes (${episodesDiv.children.length} of ${data.total})`;
+                } else {
+                    moreButton.remove();
+                }
+            } catch (error) {
+                console.error('Episode listing error:', error);
+                moreButton.disabled = false;
+                showError(error.message);
+            }
+        });
+        if (series.episode_count <= series.latest_episodes.length) {
+            moreButton.remove();
+        }
+
+        return item;
+    }
+
+    function createResultCard(result) {
+        const title = result.title || result.name || 'Untitled';
+        const description = result.description || result.desc || '';
+        const id = result.pid || result.id || '';
+        const safeTitle = title.replace(/'/g, "\\'");
+        const thumb = createThumb(result.image);
+
+        const seriesLine = (result.series_title && result.series_title !== title)
+            ? `<div class="result-series">${result.series_title}${result.episode_info ? ' · ' + result.episode_info : ''}</div>`
+            : (result.episode_info ? `<div class="result-series">${result.episode_info}</div>` : '');
+
+        const badges = createBadges(result);
+
+        const item = document.createElement('div');
+        item.className = 'result-card';
+        item.innerHTML = `
+            <div class="result-thumb">${thumb}</div>
+            <div class="result-body">
+                <div class="result-title">${title}</div>
+                ${seriesLine}
+                ${description ? `<div class="result-desc">${description}</div>` : ''}
+                <div class="result-meta">${badges}</div>
+            </div>
+            <div class="result-actions">
+                <button class="btn-download"
+                        onclick="downloadShow('${id}', '${safeTitle}', this)"
+                        data-pid="${id}">
+                    <i class="bi bi-download me-1"></i>Download
+                </button>
+            </div>`;
+        return item;
     }
 
     // Make downloadShow globally accessible